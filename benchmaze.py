@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+'''
+Benchmark the maze generator over a range of sizes and fill ratios. Every
+case generates the mazes of the same seeds, so the results of two versions
+of genmaze can be compared. The times of genmaze and of its
+get_new_wall_link and format_maze calls are reported as percentiles, with
+the peak memory of each case, and saved as JSON.
+
+Usage: python benchmaze.py [-n<seeds>] [-s<nrows>x<ncols>,...] [-f<ratio>,...]
+                           [-o<results file>] [-c<results file to compare>]
+'''
+import os, sys, time, json, platform
+import multiprocessing
+from timeit import default_timer
+try:
+    import resource # the peak memory, not available on Windows
+except ImportError:
+    resource = None
+import genmaze
+
+SIZES                   = [(15, 15), (21, 21), (29, 33), (41, 41), (61, 61), (81, 81), (101, 101)]
+RATIOS                  = [0.12, 0.14, 0.16, 0.33]
+PERCENTILES             = [50, 90, 99]
+
+
+class Timer(object):
+    '''
+    Replaces a function of genmaze to record the time of every call
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.func = getattr(genmaze, name)
+        self.times = []
+
+    def __call__(self, *args, **kwargs):
+        stime = default_timer()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.times.append(default_timer() - stime)
+
+    def install(self):
+        setattr(genmaze, self.name, self)
+
+    def uninstall(self):
+        setattr(genmaze, self.name, self.func)
+
+
+def get_peak_memory():
+    '''
+    The peak resident memory of the process in kilobytes, None if unknown
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # in bytes there
+        peak /= 1024
+    return peak
+
+
+def summarize(times):
+    '''
+    The percentiles, mean and extremes of the times in milliseconds
+    '''
+    times = sorted(times)
+    summary = {'count': len(times)}
+    if not times:
+        return summary
+    for pct in PERCENTILES:
+        idx = min(len(times)-1, int(round(pct/100.0*(len(times)-1))))
+        summary['p%d' % pct] = times[idx]*1000
+    summary['min'] = times[0]*1000
+    summary['max'] = times[-1]*1000
+    summary['mean'] = sum(times)/len(times)*1000
+    return summary
+
+
+def run_case((nrows, ncols, path_fill_ratio, seeds)):
+    '''
+    Benchmark one size and ratio (in its own process for the peak memory)
+    '''
+    memory_before = get_peak_memory()
+
+    # the plain generation
+    times = []
+    for seed in seeds:
+        stime = default_timer()
+        genmaze.genmaze(nrows, ncols, path_fill_ratio, seed=seed, cachedir=None)
+        times.append(default_timer() - stime)
+
+    # the same again with the parts timed
+    timers = [Timer('get_new_wall_link'), Timer('format_maze')]
+    for timer in timers:
+        timer.install()
+    try:
+        for seed in seeds:
+            genmaze.genmaze(nrows, ncols, path_fill_ratio, seed=seed, cachedir=None)
+    finally:
+        for timer in timers:
+            timer.uninstall()
+
+    memory_after = get_peak_memory()
+    result = {'nrows': nrows, 'ncols': ncols, 'ratio': path_fill_ratio,
+            'genmaze': summarize(times)}
+    for timer in timers:
+        result[timer.name] = summarize(timer.times)
+    result['peak_memory_kb'] = memory_after
+    if memory_before is not None:
+        result['peak_memory_growth_kb'] = memory_after - memory_before
+    return result
+
+
+def get_revision():
+    '''
+    The git commit of the generator, if it is in a git checkout
+    '''
+    try:
+        import subprocess
+        srcdir = os.path.dirname(os.path.abspath(genmaze.__file__))
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=srcdir, stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline):
+    '''
+    Print the median genmaze times against the ones of a previous run
+    '''
+    old = {}
+    for result in baseline['results']:
+        old[(result['nrows'], result['ncols'], result['ratio'])] = result
+    print
+    print 'compared to %s (%s)' % (baseline.get('revision'), baseline.get('date'))
+    for result in results:
+        key = (result['nrows'], result['ncols'], result['ratio'])
+        if key not in old:
+            continue
+        p50 = result['genmaze']['p50']
+        p50_old = old[key]['genmaze']['p50']
+        print '%3dx%-3d %5.2f  p50 %9.2f ms -> %9.2f ms  x%.2f' % (key[0], key[1], key[2],
+                p50_old, p50, p50_old/p50 if p50 > 0 else 0.0)
+
+
+if __name__ == '__main__':
+
+    nseeds = 10
+    sizes = SIZES
+    ratios = RATIOS
+    outfile = 'benchmaze.json'
+    basefile = None
+    for argv in sys.argv[1:]:
+        if argv[0:2] == '-n':
+            nseeds = int(argv[2:])
+        elif argv[0:2] == '-s':
+            sizes = [tuple([int(i) for i in size.split('x')]) for size in argv[2:].split(',')]
+        elif argv[0:2] == '-f':
+            ratios = [float(ratio) for ratio in argv[2:].split(',')]
+        elif argv[0:2] == '-o':
+            outfile = argv[2:]
+        elif argv[0:2] == '-c':
+            basefile = argv[2:]
+
+    seeds = range(nseeds)
+    print '%7s %5s %10s %10s %10s %12s %12s %10s' % ('size', 'ratio', 'p50(ms)', 'p90(ms)',
+            'p99(ms)', 'link p50(ms)', 'format p50', 'peak(kB)')
+    results = []
+    for nrows, ncols in sizes:
+        for ratio in ratios:
+            # a new process per case, so the peak memory is its own
+            workers = multiprocessing.Pool(1)
+            result = workers.apply(run_case, ((nrows, ncols, ratio, seeds),))
+            workers.close()
+            workers.join()
+            results.append(result)
+            print '%3dx%-3d %5.2f %10.2f %10.2f %10.2f %12.4f %12.3f %10s' % (nrows, ncols, ratio,
+                    result['genmaze']['p50'], result['genmaze']['p90'], result['genmaze']['p99'],
+                    result['get_new_wall_link'].get('p50', 0.0), result['format_maze']['p50'],
+                    result['peak_memory_kb'])
+
+    report = {'generator_version': genmaze.GENERATOR_VERSION,
+            'revision': get_revision(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seeds': seeds,
+            'results': results}
+    outs = open(outfile, 'w')
+    json.dump(report, outs, indent=1, sort_keys=True)
+    outs.close()
+    print 'saved to', outfile
+
+    if basefile is not None:
+        infile = open(basefile)
+        compare(results, json.load(infile))
+        infile.close()
@@ -1,10 +1,17 @@
 #!/usr/bin/env python
-import os, sys, time, random, base64
+import os, sys, time, random, base64, hashlib, threading, zlib
+import cPickle
 import ConfigParser
 import pygame
 from pygame.locals import *
+try:
+    import numpy # fast recoloring of the sprites, optional
+except ImportError:
+    numpy = None
 import pprint
 import genmaze
+import mazepool
+import pathfinder
 
 '''
 A Pac-Man clone with improved game mechanics.
@@ -90,6 +97,25 @@ L_GHOST_7               = '7'
 L_GHOST_8               = '8'
 L_GHOST_9               = '9'
 
+# The characters that block the ghosts, the dying ones can pass the door
+BLOCKS_GHOST            = [L_WALL, L_GHOST_DOOR]
+BLOCKS_GHOST_DYING      = [L_WALL]
+
+# The blocker profiles of the legal move tables
+PROFILE_NORMAL          = 0 # the ghosts, fruits and eatman
+PROFILE_DYING           = 1 # the dying ghosts
+PROFILE_DAO             = 2 # the eatman that can pass the walls
+
+# The bits of the wall neighbours of a wall tile
+WALL_U                  = 1
+WALL_D                  = 2
+WALL_L                  = 4
+WALL_R                  = 8
+WALL_UL                 = 16
+WALL_UR                 = 32
+WALL_LL                 = 64
+WALL_LR                 = 128
+
 #                           R    G    B
 RED                     = (255,   0,   0, 255)
 PINK                    = (255, 128, 255, 255)
@@ -142,13 +168,186 @@ class Config(object):
         return self.pars[section][option]
 
 
+class GameClock(object):
+    '''
+    The time of the game. It is sampled once per frame by tick and the
+    sample is passed to the update and draw methods. Objects created during
+    the frame read it from now.
+
+    With a fixed timestep dt, the game time moves in steps of dt with one
+    update of the game logic per step. An accumulator keeps the steps in pace
+    with the wall clock. Otherwise there is one update per frame.
+    '''
+
+    MAX_STEPS               = 8 # steps in one frame before giving up catching up
+
+    def __init__(self, dt=0.0):
+        self.dt = dt
+        self.now = time.time()
+        self.wall = self.now
+        self.accumulator = 0.0
+
+    def tick(self):
+        '''
+        Sample the clock for a new frame. Returns the game times at which the
+        logic is to be updated in this frame.
+        '''
+        wall = time.time()
+        if self.dt <= 0:
+            self.now = self.wall = wall
+            return [self.now]
+
+        self.accumulator += wall - self.wall
+        self.wall = wall
+        steps = []
+        while self.accumulator >= self.dt and len(steps) < GameClock.MAX_STEPS:
+            self.accumulator -= self.dt
+            self.now += self.dt
+            steps.append(self.now)
+        if len(steps) == GameClock.MAX_STEPS:
+            # the frames are too slow, let the game slow down instead
+            self.accumulator = 0.0
+        return steps
+
+    def resync(self):
+        '''
+        Jump the game time along with the wall clock without updating the
+        logic, e.g. after a pause that has been added to all the timers.
+        '''
+        wall = time.time()
+        self.now += wall - self.wall
+        self.wall = wall
+
+
+class SimClock(GameClock):
+    '''
+    A clock that only moves when told, by a fixed step per frame. It is used
+    to run the game logic faster than real time (see simulate.py).
+    '''
+
+    def __init__(self, dt, start=1000.0):
+        self.dt = dt
+        self.start = start
+        self.now = start
+        self.nframes = 0
+
+    def tick(self):
+        self.nframes += 1
+        self.now = self.start + self.nframes*self.dt
+        return [self.now]
+
+    def resync(self):
+        pass
+
+
+def recolor_surface(surf, palette):
+    '''
+    Replace the colors of a surface in place by the (old, new) color pairs
+    of the palette. Every pair applies to the original colors, so colors can
+    also be swapped.
+    '''
+    olds = [surf.map_rgb(old) for old, new in palette]
+    news = [surf.map_rgb(new) for old, new in palette]
+
+    if numpy is not None and surf.get_bytesize() != 3:
+        pixels = pygame.surfarray.pixels2d(surf)
+        masks = [pixels == old for old in olds]
+        for mask, new in zip(masks, news):
+            pixels[mask] = new
+        del pixels # unlock the surface
+
+    elif not set(news) & set(olds):
+        # one pair after another is the same when no new color is replaced again
+        pixels = pygame.PixelArray(surf)
+        for old, new in zip(olds, news):
+            pixels.replace(old, new)
+        del pixels
+
+    else:
+        width, height = surf.get_size()
+        for x in range(width):
+            for y in range(height):
+                color = surf.get_at((x,y))
+                for old, new in palette:
+                    if color == old:
+                        surf.set_at((x,y), new)
+                        break
+
+
+def classify_wall(mask):
+    '''
+    The wall tile and the corners to erase of a wall with the given mask of
+    wall neighbours.
+    '''
+    u, d, l, r = mask & WALL_U, mask & WALL_D, mask & WALL_L, mask & WALL_R
+    corners = [corner for corner, bit in (('ul', WALL_UL), ('ur', WALL_UR), 
+            ('ll', WALL_LL), ('lr', WALL_LR)) if mask & bit]
+
+    if u and d and l and r:
+        return 'wall-x', corners
+    if u and d and l:
+        return 'wall-t-r', [c for c in corners if c in ('ul', 'll')]
+    if u and d and r:
+        return 'wall-t-l', [c for c in corners if c in ('ur', 'lr')]
+    if u and l and r:
+        return 'wall-t-b', [c for c in corners if c in ('ul', 'ur')]
+    if d and l and r:
+        return 'wall-t-t', [c for c in corners if c in ('ll', 'lr')]
+    if r and d:
+        return 'wall-corner-ul', [c for c in corners if c == 'lr']
+    if r and u:
+        return 'wall-corner-ll', [c for c in corners if c == 'ur']
+    if l and d:
+        return 'wall-corner-ur', [c for c in corners if c == 'll']
+    if l and u:
+        return 'wall-corner-lr', [c for c in corners if c == 'ul']
+    if l and r:
+        return 'wall-straight-hori', []
+    if u and d:
+        return 'wall-straight-vert', []
+    if l:
+        return 'wall-end-r', []
+    if r:
+        return 'wall-end-l', []
+    if u:
+        return 'wall-end-b', []
+    if d:
+        return 'wall-end-t', []
+    return 'wall-nub', []
+
+# The wall tile and corners of every mask of wall neighbours
+WALL_TILES = [classify_wall(mask) for mask in range(256)]
+
+# Where the corners to erase are in a tile
+WALL_CORNER_RECTS = {'ul': (0, 0, 5, 5), 'ur': (19, 0, 5, 5), 
+        'll': (0, 19, 5, 5), 'lr': (19, 19, 5, 5)}
+
+
+class SilentSound(object):
+    '''
+    Stands in for a sound when the game runs without sound.
+    '''
+
+    def play(self, *args):
+        pass
+
+
 class Resource(object):
     '''
     The class to store common game resources, including tiles, sounds, texts etc.
     '''
 
     def __init__(self):
-        pass
+        # The ghost frames without eyes and the finished frames with the
+        # pupils, both shared by all the ghosts of the same color
+        self.ghost_bodies = {}
+        self.ghost_frames = {}
+        # The recolored sprites by their names and palettes
+        self.recolored = {}
+        # The recolored tile sets by the level palettes
+        self.tilesets = {}
+        # The finished wall tiles of every wall mask by the level palettes
+        self.walltiles = {}
 
     def load_tiles(self):
         self.tiles = {}
@@ -166,9 +365,17 @@ class Resource(object):
                 key = filename[:-4]
                 self.sounds[key] = pygame.mixer.Sound(os.path.join(SRCDIR,'sounds',filename))
 
+    def load_silent_sounds(self):
+        self.sounds = {}
+        files = os.listdir(os.path.join(SRCDIR,'sounds'))
+        for filename in files:
+            if filename[-3:] == 'wav':
+                key = filename[:-4]
+                self.sounds[key] = SilentSound()
 
     def load_sprites(self):
         self.fires = {}
+        self.ghosts = {}
         self.ghost_freighten = {}
         self.ghost_recover = {}
         self.glasses = {}
@@ -187,24 +394,15 @@ class Resource(object):
                 key = filename[:-4]
                 self.fires[key] = pygame.image.load(os.path.join(SRCDIR,'sprites',filename)).convert()
 
+            if filename[:-6] == 'ghost' and filename[-3:]=='gif':
+                key = filename[:-4]
+                self.ghosts[key] = pygame.image.load(os.path.join(SRCDIR,'sprites',filename)).convert()
+
             if filename[:-6] == 'ghost-freighten' and filename[-3:]=='gif':
                 key = filename[:-4]
                 img = pygame.image.load(os.path.join(SRCDIR,'sprites',filename)).convert()
-                img2 = img.copy()
-
-                for ii in range(TILE_WIDTH):
-                    for jj in range(TILE_HEIGHT):
-                        if img.get_at((ii,jj)) == RED:
-                            img.set_at((ii,jj), BLUE)
-                self.ghost_freighten[key] = img
-
-                for ii in range(TILE_WIDTH):
-                    for jj in range(TILE_HEIGHT):
-                        if img2.get_at((ii,jj)) == WHITE:
-                            img2.set_at((ii,jj), RED)
-                        elif img2.get_at((ii,jj)) == RED:
-                            img2.set_at((ii,jj), WHITE)
-                self.ghost_recover[key] = img2
+                self.ghost_freighten[key] = self.get_recolored(key, img, ((RED, BLUE),))
+                self.ghost_recover[key] = self.get_recolored(key, img, ((WHITE, RED), (RED, WHITE)))
 
             if filename == 'glasses.gif':
                 self.glasses['glasses'] = pygame.image.load(
@@ -229,33 +427,86 @@ class Resource(object):
                 self.lightning[key] = pygame.image.load(os.path.join(SRCDIR,'sprites',filename)).convert()
 
 
-    def recolor_tiles(self, level):
+    def get_recolored(self, name, surf, palette):
         '''
-        Re-color the tiles according to the settings in level file.
+        A copy of the named surface recolored by the palette (see
+        recolor_surface). It is made only once for the same name and palette.
         '''
-        for key in self.tiles:
-
-            if key[0:4] == 'wall':
-
-                for x in range(TILE_WIDTH):
-                    for y in range(TILE_HEIGHT):
-
-                        if self.tiles[key].get_at((x,y))==WALL_FILL_COLOR:
-                            self.tiles[key].set_at((x,y), level.wallbgcolor)
-
-                        elif self.tiles[key].get_at((x,y)) == WALL_BRIGHT_COLOR:
-                            self.tiles[key].set_at((x,y), level.wallbrightcolor)
+        key = (name, palette)
+        img = self.recolored.get(key)
+        if img is None:
+            img = surf.copy()
+            recolor_surface(img, palette)
+            self.recolored[key] = img
+        return img
+
+    def get_ghost_frame(self, color, idx_frame, pupil_pos, pupil_color=BLACK):
+        '''
+        A ghost frame with its pupils, painted the first time it is asked for.
+        The bodies of the color must have been loaded (see Ghost.load_sprites).
+        '''
+        key = (color, idx_frame, pupil_pos, pupil_color)
+        img = self.ghost_frames.get(key)
+        if img is None:
+            img = self.ghost_bodies[color][idx_frame].copy()
+            img.fill(pupil_color, (pupil_pos[0], pupil_pos[1], 2, 3))
+            img.fill(pupil_color, (pupil_pos[0]+9, pupil_pos[1], 2, 3))
+            self.ghost_frames[key] = img
+        return img
+
+    def get_tileset(self, palette):
+        '''
+        The tiles re-colored by a level palette of (wallbgcolor, wallbrightcolor,
+        wallshadowcolor, beancolor). The loaded tiles are never changed, every
+        palette gets its own copies, which are made only once.
+        '''
+        tileset = self.tilesets.get(palette)
+        if tileset is None:
+            wallbgcolor, wallbrightcolor, wallshadowcolor, beancolor = palette
+            tileset = {}
+            for key in self.tiles:
+
+                if key[0:4] == 'wall':
+                    img = self.tiles[key].copy()
+                    recolor_surface(img, ((WALL_FILL_COLOR, wallbgcolor), 
+                            (WALL_BRIGHT_COLOR, wallbrightcolor), 
+                            (WALL_SHADOW_COLOR, wallshadowcolor)))
+                        
+                elif key[0:4] == 'bean':
+                    img = self.tiles[key].copy()
+                    recolor_surface(img, ((BEAN_FILL_COLOR, beancolor),))
 
-                        elif self.tiles[key].get_at((x,y)) == WALL_SHADOW_COLOR:
-                            self.tiles[key].set_at((x,y), level.wallshadowcolor)
-                    
-            elif key[0:4] == 'bean':
+                else:
+                    img = self.tiles[key]
 
-                for x in range(TILE_WIDTH):
-                    for y in range(TILE_HEIGHT):
+                tileset[key] = img
+            self.tilesets[palette] = tileset
+        return tileset
 
-                        if self.tiles[key].get_at((x,y))==BEAN_FILL_COLOR:
-                            self.tiles[key].set_at((x,y), level.beancolor)
+    def get_walltiles(self, palette):
+        '''
+        The 256 wall tiles of a level palette, indexed by the mask of wall
+        neighbours, with the corners already erased. The masks of the same
+        tile and corners share one surface.
+        '''
+        walltiles = self.walltiles.get(palette)
+        if walltiles is None:
+            tileset = self.get_tileset(palette)
+            made = {}
+            walltiles = []
+            for name, corners in WALL_TILES:
+                key = (name, tuple(corners))
+                img = made.get(key)
+                if img is None:
+                    img = tileset[name]
+                    if corners:
+                        img = img.copy()
+                        for corner in corners:
+                            img.fill(palette[0], WALL_CORNER_RECTS[corner])
+                    made[key] = img
+                walltiles.append(img)
+            self.walltiles[palette] = walltiles
+        return walltiles
 
 
 
@@ -263,22 +514,69 @@ class Resource(object):
 # The global variables
 
 config = Config() # Read the config.ini file
+gameclock = GameClock(config.get('Game','ffixedtimestep')) # the time of the game
+# The random numbers that are only used for looks, so drawing or not does not
+# change the random sequence of the game logic
+cosmetic_random = random.Random()
 resource = Resource()
 hiscore = 0
 hsnames = []
 hsvalues = []
 score = 0
 hilevel = 1
+prefetch = None # the next level being prepared in the background
+mazes = None # the generated mazes made ahead by the worker processes
 nlifes = 0
 score_reward = 0
 BASICFONT = None
 
 #################################################################################
 
+def get_level_filename(iLevel):
+    '''
+    The level file of a level, which may not exist
+    '''
+    return os.path.join(SRCDIR, 'levels', str(iLevel)+'.dat')
+
+
+def read_level_data(iLevel):
+    '''
+    The lines of a level file. The levels without a file are generated.
+    '''
+    filename = get_level_filename(iLevel)
+    if os.path.exists(filename):
+        infile = open(filename)
+        data = infile.readlines()
+    else:
+        nrows, ncols = get_maze_size(iLevel)
+        data = mazes.get(nrows, ncols) if mazes is not None else None
+        if data is None:
+            path_fill_ratio = random.uniform(0.12, 0.16)
+            data = genmaze.genmaze(nrows, ncols, path_fill_ratio)
+    return data
+
+
+def get_maze_size(iLevel):
+    '''
+    The size of the generated maze of a level as (nrows, ncols)
+    '''
+    # dimension size, increase by 2 every 4 levels
+    nrows = 21 + (iLevel/4)*2
+    if nrows > 29:
+        nrows = 29
+    ncols = 21 + (iLevel/4)*2
+    if ncols > 33:
+        ncols = 33
+    return nrows, ncols
+
+
 class Level(object):
 
+    CACHE_VERSION           = 2 # of the compiled levels, bump when they change
+    MAX_CACHE_BYTES         = 8*1024*1024 # the oldest compiled levels are removed over it
+
     def __init__(self):
-        self.stime = time.time()
+        self.stime = gameclock.now
         self.wallbgcolor = (0, 0, 0)
         self.beancolor = (255, 255, 255)
         self.wallbrightcolor = (0, 0, 255)
@@ -296,7 +594,7 @@ class Level(object):
 
         self.uvpos_teleport = []
 
-        self.fruit_lastSpawnTime = time.time()
+        self.fruit_lastSpawnTime = gameclock.now
 
         # stats of the this level
         self.score_pre = score # previous score for calculate score gained this level
@@ -304,7 +602,11 @@ class Level(object):
         self.fruit_ate = []
         self.buff_ate = []
 
-    def load(self, iLevel):
+    def load(self, iLevel, data=None):
+        '''
+        Set up the level from its data, which is read by read_level_data if
+        not given.
+        '''
         self.iLevel = iLevel
 
         # set up the available buff pool based on level number
@@ -328,20 +630,15 @@ class Level(object):
                     moltenratio = 50
                 self.ghost_params[ii]['molten'] = moltenratio
 
-        filename = os.path.join(SRCDIR, 'levels', str(iLevel)+'.dat') 
-        if os.path.exists(filename):
-            infile = open(os.path.join(SRCDIR, 'levels', str(iLevel)+'.dat'))
-            data = infile.readlines()
+        if data is None:
+            data = read_level_data(iLevel)
+
+        # Only the levels of the files are cached, by the hash of the file.
+        # The generated mazes are never the same again.
+        if os.path.exists(get_level_filename(iLevel)):
+            self.digest = hashlib.sha1(''.join(data)).hexdigest()
         else:
-            path_fill_ratio = random.uniform(0.12, 0.16)
-            # dimension size, increase by 2 every 4 levels
-            nrows = 21 + (iLevel/4)*2
-            if nrows > 29:
-                nrows = 29
-            ncols = 21 + (iLevel/4)*2
-            if ncols > 33:
-                ncols = 33
-            data = genmaze.genmaze(nrows, ncols, path_fill_ratio)
+            self.digest = None
 
         self.data = []
         for line in data:
@@ -404,50 +701,169 @@ class Level(object):
         self.fruit_pool = [fruit_lb, fruit_lb+1]
         self.fruit_pool.append(self.fruit_pool[fruit_important])
 
-    def analyze_data(self, DISPLAYSURF):
+    def get_palette(self):
+        return (self.wallbgcolor, self.wallbrightcolor, self.wallshadowcolor, self.beancolor)
+
+    def get_grid(self):
+        '''
+        The characters of the maze row after row
+        '''
+        return ''.join([''.join(row) for row in self.data])
+
+    def get_cache_filename(self):
+        '''
+        The file of the compiled level, named by the hash of the level file,
+        which has the palette too. None if the level is not from a file.
+        '''
+        if self.digest is None:
+            return None
+        return os.path.join(SRCDIR, 'cache', '%s-%d.lvl' % (self.digest, Level.CACHE_VERSION))
+
+    def get_maze_rect(self):
+        '''
+        The area of the window covered by the maze as (x, y, width, height)
+        '''
+        x, y = uv_to_xy([0, 0])
+        return (x, y, self.ncols*TILE_WIDTH, self.nrows*TILE_HEIGHT)
+
+    def get_compiled(self):
+        '''
+        The results of compile_maze, with the maze image as a string
+        '''
+        return {'version': Level.CACHE_VERSION, 
+                'nrows': self.nrows, 
+                'ncols': self.ncols, 
+                'grid': bytearray(self.get_grid()), 
+                'wallmasks': bytearray([mask for row in self.wallMasks for mask in row]), 
+                'uvpos_beans': self.uvpos_beans, 
+                'nbeans': self.nbeans, 
+                'uvpos_teleport': self.uvpos_teleport, 
+                'uvpos_ghostdoor': getattr(self, 'uvpos_ghostdoor', None), 
+                'uvpos_eatman': self.eatman_params.get('uvpos'), 
+                'uvpos_ghosts': dict([(idx, self.ghost_params[idx]['uvpos']) 
+                    for idx in self.ghost_params if 'uvpos' in self.ghost_params[idx]]), 
+                'nghosts': self.nghosts, 
+                'energyLevel': self.energyLevel, 
+                'mazerect': self.get_maze_rect(), 
+                'maze': zlib.compress(pygame.image.tostring(
+                    self.mazeSurf.subsurface(self.get_maze_rect()), 'RGB'))}
+
+    def save_compiled(self, filename):
+        '''
+        Save the results of compile_maze to the cache. A cache that cannot be
+        written is just not used.
+        '''
+        compiled = self.get_compiled()
+        try:
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            # write aside and rename, so a half written file is never loaded
+            outs = open(filename+'.tmp', 'wb')
+            cPickle.dump(compiled, outs, 2)
+            outs.close()
+            os.rename(filename+'.tmp', filename)
+            genmaze.prune_cache(os.path.dirname(filename), '.lvl', Level.MAX_CACHE_BYTES)
+        except (IOError, OSError):
+            pass
+
+    def load_compiled(self, filename, surf):
+        '''
+        Load a level compiled by compile_maze from the cache. Returns False if
+        there is no usable one.
+        '''
+        if not os.path.exists(filename):
+            return False
+        try:
+            infile = open(filename, 'rb')
+            compiled = cPickle.load(infile)
+            infile.close()
+            os.utime(filename, None) # recently used, so pruned last
+        except Exception:
+            return False
+        return self.set_compiled(compiled, surf)
+
+    def set_compiled(self, compiled, surf):
+        '''
+        Take the results of compile_maze from get_compiled, with the maze
+        drawn on a copy of the surface. Returns False if they are not for
+        this maze.
+        '''
+        if compiled.get('version') != Level.CACHE_VERSION \
+                or compiled['ncols'] != self.ncols \
+                or compiled['grid'] != bytearray(self.get_grid()):
+            return False
+
+        ncols = compiled['ncols']
+        masks = compiled['wallmasks']
+        self.wallMasks = [list(masks[v*ncols:(v+1)*ncols]) for v in range(compiled['nrows'])]
+        self.uvpos_beans = compiled['uvpos_beans']
+        self.nbeans = compiled['nbeans']
+        self.uvpos_teleport = compiled['uvpos_teleport']
+        if compiled['uvpos_ghostdoor'] is not None:
+            self.uvpos_ghostdoor = compiled['uvpos_ghostdoor']
+        if compiled['uvpos_eatman'] is not None:
+            self.eatman_params['uvpos'] = compiled['uvpos_eatman']
+        for idx, uvpos in compiled['uvpos_ghosts'].items():
+            self.ghost_params[idx]['uvpos'] = uvpos
+        self.nghosts = compiled['nghosts']
+        self.energyLevel = compiled['energyLevel']
+        x, y, width, height = compiled['mazerect']
+        img = pygame.image.fromstring(zlib.decompress(compiled['maze']), (width, height), 'RGB')
+        self.mazeSurf = surf.copy()
+        self.mazeSurf.blit(img, (x, y))
+        return True
+
+    def compile_maze(self, surf):
+        '''
+        Find the tiles and the positions of the level and draw the maze on a
+        copy of the surface. All that depends only on the maze and the
+        palette, so it can be cached.
+        '''
+        # the tiles in the colors of the level
+        tiles = resource.get_tileset(self.get_palette())
+        walltiles = resource.get_walltiles(self.get_palette())
+        self.wallMasks = self.get_wall_masks()
 
         # Create the surface to display the static objects (e.g. walls)
-        self.mazeSurf = DISPLAYSURF.copy()
-        # The dynamic objects including beans
-        self.dynamicObjects = {}
+        self.mazeSurf = surf.copy()
         self.uvpos_beans = []
 
         # Analyze the data for tile information
         for v in range(self.nrows):
             for u in range(self.ncols):
 
+                # The walls are already finished by their masks
+                if self.data[v][u] == L_WALL:
+                    self.mazeSurf.blit(walltiles[self.wallMasks[v][u]], uv_to_xy([u, v]))
+                    continue
+
                 tileRes = self.analyze_tile(u, v) # what is this tile
 
-                # If it is a wall tile
+                # If it is the ghost door
                 if tileRes is not None and tileRes[0][0:4] != 'bean':
-                    img = resource.tiles[tileRes[0]].copy()
-                    # Erase any corner pixels for blocky walls
-                    for corner in tileRes[1]:
-                        if corner == 'ul':
-                            xstart = 0
-                            ystart = 0
-                        elif corner == 'ur':
-                            xstart = 19
-                            ystart = 0
-                        elif corner == 'll':
-                            xstart = 0
-                            ystart = 19
-                        elif corner == 'lr':
-                            xstart = 19
-                            ystart = 19
-                        for ii in range(5):
-                            for jj in range(5):
-                                img.set_at((xstart+ii,ystart+jj), self.wallbgcolor)
-                    # Draw this wall tile
-                    self.mazeSurf.blit(img, uv_to_xy([u, v]))
+                    self.mazeSurf.blit(tiles[tileRes[0]], uv_to_xy([u, v]))
 
                 # If it is a bean
                 elif tileRes is not None and tileRes[0][0:4] == 'bean':
-                    img = resource.tiles[tileRes[0]]
-                    self.dynamicObjects[uv_to_key([u, v])] = Bean([u, v], img)
                     # get all bean locations
                     self.uvpos_beans.append([u,v])
 
+        # the beans eaten to fill the energy bar for each buff
+        self.energyLevel = range(0, self.nbeans, 65)
+        self.energyLevel.append(self.nbeans*2)
+
+    def analyze_data(self, DISPLAYSURF, compiled=None):
+
+        # The walls and beans are compiled once for a maze and palette, if
+        # not already done in the background (see LevelPrefetch)
+        if compiled is None or not self.set_compiled(compiled, DISPLAYSURF):
+            filename = self.get_cache_filename()
+            if filename is None or not config.get('Game','blevelcache'):
+                self.compile_maze(DISPLAYSURF)
+            elif not self.load_compiled(filename, DISPLAYSURF):
+                self.compile_maze(DISPLAYSURF)
+                self.save_compiled(filename)
+
         # draw other static objects
         # level
         theSurf, theRect = make_text_image('level', BASICFONT, WHITE)
@@ -498,6 +914,16 @@ class Level(object):
         theRect.topleft = (10, 26)
         self.mazeSurf.blit(theSurf, theRect)
 
+        # The background is the maze with the beans not eaten yet. The eaten
+        # beans are erased from it one tile at a time (see erase_bean).
+        tiles = resource.get_tileset(self.get_palette())
+        self.backgroundSurf = self.mazeSurf.copy()
+        for u, v in self.uvpos_beans:
+            img = tiles['bean-big' if self.data[v][u] == L_BEAN_BIG else 'bean']
+            self.backgroundSurf.blit(img, uv_to_xy([u, v]))
+        # the areas of the background changed since the last frame
+        self.dirtyRects = []
+
         # The energy bar
         #quarter_width = int(WINDOW_WIDTH/4.0)
         #rect = [quarter_width, WINDOW_HEIGHT - 2*TILE_HEIGHT, quarter_width*2, TILE_HEIGHT]
@@ -510,8 +936,6 @@ class Level(object):
         #pygame.draw.rect(self.mazeSurf, BLACK, rect)
         
         self.buffs = []
-        self.energyLevel = range(0, self.nbeans, 65)
-        self.energyLevel.append(self.nbeans*2)
         self.idx_energyLevel = 1
         self.energy_decay_time = 2.0
         for ii in range(len(self.energyLevel)-1):
@@ -520,27 +944,70 @@ class Level(object):
             if thebuff == BUFF_1UP: # can only have one 1up buff per level
                 self.buff_pool.remove(BUFF_1UP)
 
+        # The legal exits of every cell for each of the blocker profiles
+        self.build_exits()
+
+        # The shortest routes for the ghosts. The ends of the tunnels take
+        # them to the other side.
+        wraps = {}
+        for u, v in self.uvpos_teleport:
+            if u == 0:
+                wraps[(v, u)] = (v, self.ncols-2)
+            elif u == self.ncols-1:
+                wraps[(v, u)] = (v, 1)
+        self.routes = pathfinder.FlowFields(self, wraps)
+        # the all-pairs table of the normal ghosts is built in the background
+        # while the level is played, the dying ghosts use per-target fields
+        self.routes.get_table(BLOCKS_GHOST).start()
+        # the junctions and corridors of the maze for the normal ghosts
+        self.junctions = self.routes.get_graph(BLOCKS_GHOST)
+
         #self.energyLevel = [0]
         #self.energyLevel.append(int(self.nbeans/3))
         #self.energyLevel.append(int(self.nbeans/1.2))
         #self.energyLevel.append(self.nbeans*2)
 
 
+    def build_exits(self):
+        '''
+        (Re)build the legal move tables. Must be called whenever a blocking
+        character of the data is changed. Eating beans does not count.
+        '''
+        self.exits = {}
+        for profile in (PROFILE_NORMAL, PROFILE_DYING, PROFILE_DAO):
+            self.exits[profile] = pathfinder.build_exits(self.nrows, self.ncols,
+                    lambda u, v, uoffset, voffset: \
+                        is_valid_cell(self, u, v, uoffset, voffset, profile))
+
+    def get_exits(self, entity, uvpos):
+        '''
+        The mask of the legal exits of a cell for the given entity
+        '''
+        return self.exits[get_profile(entity)][uvpos[1]*self.ncols+uvpos[0]]
+
+    def get_wall_masks(self):
+        '''
+        The mask of the wall neighbours (WALL_U, WALL_UL, ...) of every tile,
+        computed for the whole grid at once by shifting the rows of wall flags.
+        '''
+        ncols = self.ncols
+        empty = [0]*(ncols+2)
+        # the wall flags padded with a border of no walls
+        walls = [empty] + [[0] + [1 if char == L_WALL else 0 for char in line] + [0] 
+                for line in self.data] + [empty]
+        masks = []
+        for v in range(1, self.nrows+1):
+            up, row, down = walls[v-1], walls[v], walls[v+1]
+            masks.append([up[u]*WALL_U | down[u]*WALL_D | row[u-1]*WALL_L | row[u+1]*WALL_R 
+                    | up[u-1]*WALL_UL | up[u+1]*WALL_UR | down[u-1]*WALL_LL | down[u+1]*WALL_LR 
+                    for u in range(1, ncols+1)])
+        return masks
+
     def analyze_tile(self, ix, iy):
         '''
         Analyze a character to determine its tile name
         '''
         char = self.data[iy][ix]
-        # The chars surround it
-        char_u = None if iy==0 else self.data[iy-1][ix]
-        char_d = None if iy==self.nrows-1 else self.data[iy+1][ix]
-        char_l = None if ix==0 else self.data[iy][ix-1]
-        char_r = None if ix==self.ncols-1 else self.data[iy][ix+1]
-        # The corner pieces
-        char_ul = None if ix==0 or iy==0 else self.data[iy-1][ix-1]
-        char_ur = None if ix==self.ncols-1 or iy==0 else self.data[iy-1][ix+1]
-        char_ll = None if ix==0 or iy==self.nrows-1 else self.data[iy+1][ix-1]
-        char_lr = None if ix==self.ncols-1 or iy==self.nrows-1 else self.data[iy+1][ix+1]
 
         corner_to_erase = []
 
@@ -548,69 +1015,7 @@ class Level(object):
             return None
 
         elif char == L_WALL: # walls
-
-            if char_u==L_WALL and char_d==L_WALL and char_l==L_WALL and char_r==L_WALL:
-                if char_ul == L_WALL: corner_to_erase.append('ul')
-                if char_ur == L_WALL: corner_to_erase.append('ur')
-                if char_ll == L_WALL: corner_to_erase.append('ll')
-                if char_lr == L_WALL: corner_to_erase.append('lr')
-                return 'wall-x', corner_to_erase
-
-            if char_u==L_WALL and char_d==L_WALL and char_l==L_WALL:
-                if char_ul == L_WALL: corner_to_erase.append('ul')
-                if char_ll == L_WALL: corner_to_erase.append('ll')
-                return 'wall-t-r', corner_to_erase
-
-            if char_u==L_WALL and char_d==L_WALL and char_r==L_WALL:
-                if char_ur == L_WALL: corner_to_erase.append('ur')
-                if char_lr == L_WALL: corner_to_erase.append('lr')
-                return 'wall-t-l', corner_to_erase
-
-            if char_u==L_WALL and char_l==L_WALL and char_r==L_WALL:
-                if char_ul == L_WALL: corner_to_erase.append('ul')
-                if char_ur == L_WALL: corner_to_erase.append('ur')
-                return 'wall-t-b', corner_to_erase
-
-            if char_d==L_WALL and char_l==L_WALL and char_r==L_WALL:
-                if char_ll == L_WALL: corner_to_erase.append('ll')
-                if char_lr == L_WALL: corner_to_erase.append('lr')
-                return 'wall-t-t', corner_to_erase
-
-            if char_r==L_WALL and char_d==L_WALL:
-                if char_lr == L_WALL: corner_to_erase.append('lr')
-                return 'wall-corner-ul', corner_to_erase
-
-            if char_r==L_WALL and char_u==L_WALL:
-                if char_ur == L_WALL: corner_to_erase.append('ur')
-                return 'wall-corner-ll', corner_to_erase
-
-            if char_l==L_WALL and char_d==L_WALL:
-                if char_ll == L_WALL: corner_to_erase.append('ll')
-                return 'wall-corner-ur', corner_to_erase
-
-            if char_l==L_WALL and char_u==L_WALL:
-                if char_ul == L_WALL: corner_to_erase.append('ul')
-                return 'wall-corner-lr', corner_to_erase
-
-            if char_l==L_WALL and char_r==L_WALL:
-                return 'wall-straight-hori', corner_to_erase
-
-            if char_u==L_WALL and char_d==L_WALL:
-                return 'wall-straight-vert', corner_to_erase
-
-            if char_l==L_WALL: 
-                return 'wall-end-r', corner_to_erase
-
-            if char_r==L_WALL:
-                return 'wall-end-l', corner_to_erase
-
-            if char_u==L_WALL:
-                return 'wall-end-b', corner_to_erase
-
-            if char_d==L_WALL:
-                return 'wall-end-t', corner_to_erase
-
-            return 'wall-nub', corner_to_erase
+            return WALL_TILES[self.wallMasks[iy][ix]]
 
         elif char == L_GHOST_DOOR:
             self.uvpos_ghostdoor = [ix, iy]
@@ -649,29 +1054,76 @@ class Level(object):
 
     def draw(self, DISPLAYSURF):
 
-        # draw the maze
-        DISPLAYSURF.blit(self.mazeSurf, [0,0])
+        # draw the maze and beans
+        DISPLAYSURF.blit(self.backgroundSurf, [0,0])
 
-        # draw the daynamic objects, e.g. beans
-        for key in self.dynamicObjects:
-            obj = self.dynamicObjects[key]
-            DISPLAYSURF.blit(obj.image, uv_to_xy(obj.uvpos))
+    def draw_area(self, DISPLAYSURF, rect):
+        '''
+        Draw only the part of the maze and beans inside the rect
+        '''
+        DISPLAYSURF.blit(self.backgroundSurf, rect, rect)
+
+    def erase_bean(self, uvpos):
+        '''
+        Remove an eaten bean from the background by restoring its tile
+        '''
+        rect = pygame.Rect(uv_to_xy(uvpos), (TILE_WIDTH, TILE_HEIGHT))
+        self.backgroundSurf.blit(self.mazeSurf, rect, rect)
+        self.dirtyRects.append(rect)
+
+
+class LevelPrefetch(threading.Thread):
+    '''
+    Reads and compiles a level in the background, e.g. the next level while
+    the current one is played, so it is ready when it is needed.
+    '''
+
+    def __init__(self, iLevel, DISPLAYSURF):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.iLevel = iLevel
+        self.displaySurf = DISPLAYSURF # for the pixel format of the maze
+        self.data = None
+        self.compiled = None
+
+    def run(self):
+        data = read_level_data(self.iLevel)
+        level = Level()
+        level.load(self.iLevel, data)
+        surf = pygame.Surface((level.ncols*TILE_WIDTH, (level.nrows+4)*TILE_HEIGHT), 
+                0, self.displaySurf)
+        surf.fill(BACKGROUND_COLOR)
+        level.compile_maze(surf)
+        self.compiled = level.get_compiled()
+        self.data = data
+
+    def get(self, iLevel):
+        '''
+        The data and the compiled maze of the level, waiting for them if they
+        are not ready yet. None if it is not the prefetched level.
+        '''
+        if iLevel != self.iLevel:
+            return None
+        self.join()
+        if self.data is None: # failed
+            return None
+        return self.data, self.compiled
 
 
 class FlashingTexts(object):
     
     def __init__(self, text, xypos, duration=1.0):
-        self.stime = time.time()
+        self.stime = gameclock.now
         self.duration = duration
         self.surf, self.rect = make_text_image(text, BASICFONT, GRASS)
         self.rect.topleft = xypos
 
-    def animate(self, DISPLAYSURF):
-        if (round(time.time(),1)*10 % 2) == 0:
+    def animate(self, DISPLAYSURF, now):
+        if (round(now,1)*10 % 2) == 0:
             DISPLAYSURF.blit(self.surf, self.rect)
 
-    def is_expired(self):
-        if time.time()-self.stime > self.duration:
+    def is_expired(self, now):
+        if now-self.stime > self.duration:
             return True
         else:
             return False
@@ -681,7 +1133,7 @@ class Explosion(object):
     def __init__(self):
         self.xypos = [0, 0]
         self.active = False
-        self.lastAnimTime = time.time()
+        self.lastAnimTime = gameclock.now
         self.animFreq = config.get('Buff','fexplosion_animatefrequency')
         self.idx_frame = 0
         self.frame_sequence = range(14,-1,-1) + [0]
@@ -689,18 +1141,18 @@ class Explosion(object):
     def start(self, xypos):
         self.xypos = xypos[:]
         self.active = True
-        self.lastAnimTime = time.time()
+        self.lastAnimTime = gameclock.now
         resource.sounds['explosion'].play()
 
-    def animate(self, DISPLAYSURF):
+    def animate(self, DISPLAYSURF, now):
         if not self.active:
             return
 
         id = self.frame_sequence[self.idx_frame]
         DISPLAYSURF.blit(resource.explosion[id], self.xypos)
-        if time.time()-self.lastAnimTime > self.animFreq:
+        if now-self.lastAnimTime > self.animFreq:
             self.idx_frame += 1
-            self.lastAnimTime = time.time()
+            self.lastAnimTime = now
             if self.idx_frame >= len(self.frame_sequence):
                 self.idx_frame = 0
                 self.active = False
@@ -712,25 +1164,25 @@ class Fire(object):
 
         self.uvpos = uvpos
         self.xypos = uv_to_xy(uvpos)
-        self.stime = time.time()
+        self.stime = gameclock.now
 
-        self.lastAnimTime = time.time()
+        self.lastAnimTime = gameclock.now
         self.duration = config.get('Fire','fduration') # last for how many seconds
         self.animFreq = config.get('Fire','fanimatefrequency')
         self.idx_frame = 0
         self.frame_sequence = [1,2,3,4,5,6,7,8,1]
 
-    def animate(self, DISPLAYSURF):
+    def animate(self, DISPLAYSURF, now):
         id = self.frame_sequence[self.idx_frame]
         DISPLAYSURF.blit(resource.fires['fire-'+str(id)], self.xypos)
-        if time.time()-self.lastAnimTime > self.animFreq:
+        if now-self.lastAnimTime > self.animFreq:
             self.idx_frame += 1
-            self.lastAnimTime = time.time()
+            self.lastAnimTime = now
             if self.idx_frame >= len(self.frame_sequence):
                 self.idx_frame = 0
 
-    def is_expired(self):
-        if time.time()-self.stime > self.duration:
+    def is_expired(self, now):
+        if now-self.stime > self.duration:
             return True
         else:
             return False
@@ -741,12 +1193,12 @@ class Fruit(object):
     MOTION_IDLE = 1
     MOTION_ANIMATE = 2
 
-    lastSpawnTime = time.time()
+    lastSpawnTime = gameclock.now
     
     def __init__(self, level):
         self.animFreq = config.get('Fruit','fanimatefrequency')
         self.speed = config.get('Fruit', 'ispeed')
-        self.stime = time.time()
+        self.stime = gameclock.now
         self.duration = config.get('Fruit', 'fduration')
         fruitid = random.choice(level.fruit_pool)
         self.surf = resource.fruits[fruitid]
@@ -761,16 +1213,16 @@ class Fruit(object):
         self.nframes = len(self.y_adjust)
         self.lastAnimTime = self.stime
 
-    def draw(self, DISPLAYSURF):
+    def draw(self, DISPLAYSURF, now):
         # we need to adjust y position for bumping effects
-        if time.time()-self.stime > self.duration - 1.5:
+        if now-self.stime > self.duration - 1.5:
             if self.idx_frame % 2 == 0:
                 DISPLAYSURF.blit(self.surf, (self.xypos[0], self.xypos[1]+self.y_adjust[self.idx_frame]))
         else:
             DISPLAYSURF.blit(self.surf, (self.xypos[0], self.xypos[1]+self.y_adjust[self.idx_frame]))
 
-    def make_move(self, level):
-        if self.motion == Fruit.MOTION_ANIMATE and time.time()-self.lastAnimTime>self.animFreq:
+    def make_move(self, level, now):
+        if self.motion == Fruit.MOTION_ANIMATE and now-self.lastAnimTime>self.animFreq:
             self.idx_frame += 1
             if self.idx_frame >= self.nframes:
                 self.idx_frame = 0
@@ -786,7 +1238,7 @@ class Fruit(object):
                     self.xypos[0] -= self.speed
                 elif self.direction == RIGHT:
                     self.xypos[0] += self.speed
-                self.lastAnimTime = time.time()
+                self.lastAnimTime = now
 
         if self.motion == Fruit.MOTION_IDLE:
             if self.pathway is not None and len(self.pathway) > 0:
@@ -805,8 +1257,8 @@ class Fruit(object):
             self.motion = Ghost.MOTION_IDLE
             self.direction = STATIC
 
-    def is_expired(self):
-        if time.time()-self.stime > self.duration:
+    def is_expired(self, now):
+        if now-self.stime > self.duration:
             return True
         else:
             return False
@@ -820,7 +1272,7 @@ class Buff(object):
     def __init__(self):
         self.uvpos = [-1, -1]
         self.xypos = [0, 0]
-        self.stime = time.time()
+        self.stime = gameclock.now
         self.duration = config.get('Buff','fduration')
         self.active = False
 
@@ -836,7 +1288,7 @@ class Buff(object):
         else:
             self.type = type
         self.surf = resource.buffs[self.type]
-        self.stime = time.time()
+        self.stime = gameclock.now
 
     def apply(self, eatman, ghosts, fires, explosion, electric):
         if self.type == BUFF_SLOW:
@@ -858,6 +1310,7 @@ class Buff(object):
             if len(ghost_to_die) > 0:
                 ghost_to_die = random.choice(ghost_to_die)
                 ghost_to_die.mode = Ghost.MODE_DYING
+                ghost_to_die.pathway = '' # stop following the corridor
                 ghost_to_die.add_freq_modifier(
                         99999.9, len(explosion.frame_sequence)*explosion.animFreq, 
                         exclude_modes=[])
@@ -891,30 +1344,31 @@ class Buff(object):
             self.active = False
 
         self.state = Buff.OUTSIDE_MAP
-        self.stime = time.time()
+        self.stime = gameclock.now
         self.uvpos = [-1, -1]
         self.xypos = [WINDOW_WIDTH-TILE_WIDTH-10, WINDOW_HEIGHT-1*TILE_HEIGHT-18]
 
 
-    def draw(self, DISPLAYSURF, eatman):
+    def draw(self, DISPLAYSURF, eatman, now):
         if not self.active:
             return
 
-        if time.time()-self.stime > self.duration - 1.5:
-            if round(time.time()*10) % 2 == 0:
+        if now-self.stime > self.duration - 1.5:
+            if round(now*10) % 2 == 0:
                 DISPLAYSURF.blit(self.surf, self.xypos)
         else:
             DISPLAYSURF.blit(self.surf, self.xypos)
 
-        if self.state == Buff.INSIDE_MAP and round(time.time()*10) % 5 == 0:
+        if self.state == Buff.INSIDE_MAP and round(now*10) % 5 == 0:
             pygame.draw.rect(DISPLAYSURF, WHITE, 
                     self.xypos + [TILE_WIDTH, TILE_HEIGHT], 1)
 
-        if self.is_expired():
+    def update(self, eatman, now):
+        if self.active and self.is_expired(now):
             self.stop(eatman)
 
-    def is_expired(self):
-        if time.time()-self.stime > self.duration:
+    def is_expired(self, now):
+        if now-self.stime > self.duration:
             return True
         else:
             return False
@@ -927,8 +1381,8 @@ class Buff(object):
 class Electric(object):
 
     def __init__(self):
-        self.stime = time.time()
-        self.lastAnimTime = time.time()
+        self.stime = gameclock.now
+        self.lastAnimTime = gameclock.now
         self.duration = config.get('Buff','felectric_duration')
         self.animFreq = config.get('Buff','felectric_animatefrequency')
         self.idx_frame = 0
@@ -939,25 +1393,26 @@ class Electric(object):
         self.xypos = xypos
         self.uvpos = xy_to_uv(xypos)
         self.active = True
-        self.stime = time.time()
+        self.stime = gameclock.now
 
-    def animate(self, DISPLAYSURF):
+    def animate(self, DISPLAYSURF, now):
         if not self.active:
             return
 
         id = self.frame_sequence[self.idx_frame]
         DISPLAYSURF.blit(resource.lightning['lightning-'+str(id)], self.xypos)
-        if time.time()-self.lastAnimTime > self.animFreq:
+        if now-self.lastAnimTime > self.animFreq:
             self.idx_frame += 1
-            self.lastAnimTime = time.time()
+            self.lastAnimTime = now
             if self.idx_frame >= len(self.frame_sequence):
                 self.idx_frame = 0
 
-        if self.is_expired():
+    def update(self, now):
+        if self.active and self.is_expired(now):
             self.active = False
 
-    def is_expired(self):
-        if time.time()-self.stime > self.duration:
+    def is_expired(self, now):
+        if now-self.stime > self.duration:
             return True
         else:
             return False
@@ -1007,7 +1462,7 @@ class Ghost(object):
         self.oldMode = self.mode
 
         self.nalters = 0 # how many mode alternation has happened
-        self.lastMaTime = time.time() # last mode alternation time
+        self.lastMaTime = gameclock.now # last mode alternation time
 
         self.mode_duration_base = {}
 
@@ -1018,7 +1473,7 @@ class Ghost(object):
         self.mode_duration_base[Ghost.MODE_CHASE] = 15 + level.iLevel
         self.mode_duration = self.generate_mode_duration()
 
-        self.lastDeadTime = time.time()
+        self.lastDeadTime = gameclock.now
         self.dead_duration = 5.0
 
         self.xypos = uv_to_xy(level.ghost_params[idx]['uvpos'])
@@ -1032,9 +1487,9 @@ class Ghost(object):
         self.direction = STATIC
         self.movedFrom = None
         self.idx_frame = 0
-        self.lastAnimTime = time.time()
+        self.lastAnimTime = gameclock.now
 
-        self.lastIndoorTime = time.time()
+        self.lastIndoorTime = gameclock.now
 
         # Default settings for different IDs
         if idx == 0:
@@ -1107,22 +1562,27 @@ class Ghost(object):
     def load_sprites(self):
         frame_sequence = [1,2,3,4,5,4,3,2,1]
         self.nframes = len(frame_sequence)
+        # the frames are made once per color
+        if self.color in resource.ghost_bodies:
+            self.frames = resource.ghost_bodies[self.color]
+            return
+
         self.frames = []
         for idx_frame in range(self.nframes):
-            filename = os.path.join(SRCDIR,'sprites','ghost-'+str(frame_sequence[idx_frame])+'.gif')
-            img = pygame.image.load(filename).convert()
+            key = 'ghost-'+str(frame_sequence[idx_frame])
             # modify the color
-            for x in range(TILE_WIDTH):
-                for y in range(TILE_HEIGHT):
-                    if img.get_at((x,y)) == RED:
-                        img.set_at((x,y), self.color)
+            img = resource.get_recolored(key, resource.ghosts[key], ((RED, self.color),)).copy()
             # remove the eyes, will be drawn dynamically
-            for y in range(6,12):
-                for x in [5,6,8,9]:
-                    img.set_at((x,y), WHITE)
-                    img.set_at((x+9,y), WHITE)
+            for x in [5, 8, 14, 17]:
+                img.fill(WHITE, (x, 6, 2, 6))
             # Add this frame to the list
             self.frames.append(img)
+        resource.ghost_bodies[self.color] = self.frames
+
+        # the frames with the pupils looking in all the directions
+        for idx_frame in range(self.nframes):
+            for pupil_pos in [Ghost.PUPIL_L, Ghost.PUPIL_R, Ghost.PUPIL_U, Ghost.PUPIL_D]:
+                resource.get_ghost_frame(self.color, idx_frame, pupil_pos, self.pupil_color)
 
     def generate_mode_duration(self):
 
@@ -1140,8 +1600,8 @@ class Ghost(object):
 
         return mode_duration
 
-    def move_outdoor(self, level):
-        if time.time() - self.lastIndoorTime < self.indoor_duration:
+    def move_outdoor(self, level, now):
+        if now - self.lastIndoorTime < self.indoor_duration:
             return False
 
         # get out of the door
@@ -1160,11 +1620,11 @@ class Ghost(object):
         return False
 
 
-    def alter_mode(self):
+    def alter_mode(self, now):
 
         # We only need alter the mode when the ghost is in scatter or chase mode
         if (self.mode == Ghost.MODE_SCATTER or self.mode == Ghost.MODE_CHASE) \
-                and time.time()-self.lastMaTime > self.mode_duration:
+                and now-self.lastMaTime > self.mode_duration:
 
             if self.mode == Ghost.MODE_SCATTER:
                 self.mode = Ghost.MODE_CHASE
@@ -1172,7 +1632,7 @@ class Ghost(object):
                 self.mode = Ghost.MODE_SCATTER
 
             self.mode_duration = self.generate_mode_duration()
-            self.lastMaTime = time.time()
+            self.lastMaTime = now
             # reverse the direction when mode alternation happens
             self.pathway = get_opposite_direction(self.direction)
             self.nalters += 1
@@ -1186,14 +1646,14 @@ class Ghost(object):
         if exclude_modes is None:
             exclude_modes = [Ghost.MODE_DYING, Ghost.MODE_DEAD]
         if self.mode not in exclude_modes:
-            stime = time.time()
+            stime = gameclock.now
             name = str(random.random()) + str(stime)
             self.freq_modifier[name] = (value, stime, duration)
             return name
         return None
 
 
-    def draw(self, DISPLAYSURF, eatman):
+    def draw(self, DISPLAYSURF, eatman, now):
 
         # No drawing is necessary when the ghost is dead
         if self.mode == Ghost.MODE_DEAD:
@@ -1208,13 +1668,12 @@ class Ghost(object):
             idx_frame = self.idx_frame % len(resource.ghost_freighten) + 1
             img = resource.ghost_freighten['ghost-freighten-'+str(idx_frame)]
             # Flash the ghost when the freighten timer has 1.5 seconds left
-            if time.time()-eatman.lastSlayerTime > config.get('Eatman','fslayerduration')-1.5:
+            if now-eatman.lastSlayerTime > config.get('Eatman','fslayerduration')-1.5:
                 if idx_frame % 2 == 0:
                     img = resource.ghost_recover['ghost-freighten-'+str(idx_frame)]
 
         # All the other modes, scatter, chase
         else:
-            img = self.frames[self.idx_frame].copy()
             # set the eye ball position
             if self.direction == LEFT:
                 self.pupil_pos = Ghost.PUPIL_L
@@ -1225,27 +1684,25 @@ class Ghost(object):
             elif self.direction == DOWN:
                 self.pupil_pos = Ghost.PUPIL_D
             else:
-                self.pupil_pos = random.choice(
+                self.pupil_pos = cosmetic_random.choice(
                         [Ghost.PUPIL_L, Ghost.PUPIL_R, Ghost.PUPIL_U, Ghost.PUPIL_D])
-            # draw eye balls
-            for y in range(self.pupil_pos[1], self.pupil_pos[1]+3):
-                for x in range(self.pupil_pos[0], self.pupil_pos[0]+2):
-                    img.set_at((x,y), self.pupil_color)
-                    img.set_at((x+9,y), self.pupil_color)
+            # the frame with the eye balls
+            img = resource.get_ghost_frame(self.color, self.idx_frame, 
+                    self.pupil_pos, self.pupil_color)
 
         # Draw the actual image
         DISPLAYSURF.blit(img, self.xypos)
 
 
-    def make_move(self, level, eatman, fires):
+    def make_move(self, level, eatman, fires, now):
 
         # If the ghost is dead, we may not need any moves
         if self.mode == Ghost.MODE_DEAD:
             # if the dead timer expires, we let the ghost return to scatter mode and reset timers
-            if time.time()-self.lastDeadTime > self.dead_duration:
+            if now-self.lastDeadTime > self.dead_duration:
                 self.mode = Ghost.MODE_SCATTER
                 self.mode_duration = self.generate_mode_duration()
-                self.lastMaTime = time.time() 
+                self.lastMaTime = now 
                 # the ghost is respawned and ready to make moves now
             else:
                 return # the ghost is still dead and no move is needed
@@ -1253,9 +1710,9 @@ class Ghost(object):
         # If the ghost is in freightened mode
         if self.mode == Ghost.MODE_FREIGHTEN:
             # check if the mode expires
-            if time.time()-eatman.lastSlayerTime > config.get('Eatman','fslayerduration'):
+            if now-eatman.lastSlayerTime > config.get('Eatman','fslayerduration'):
                 self.mode = self.oldMode # restore the old mode before the freightened mode
-                self.lastMaTime += time.time() - eatman.lastSlayerTime # re-calculate timers
+                self.lastMaTime += now - eatman.lastSlayerTime # re-calculate timers
                 # now ready to make moves
 
         # Calculate its animation frequency
@@ -1273,7 +1730,7 @@ class Ghost(object):
         # Modify the animate frequency through the modifiers
         for key in self.freq_modifier.keys():
             value, stime, duration = self.freq_modifier[key]
-            if duration < 0 or time.time()-stime < duration:
+            if duration < 0 or now-stime < duration:
                 animFreq *= value
             else:
                 del self.freq_modifier[key]
@@ -1281,7 +1738,7 @@ class Ghost(object):
 
         # If it is in middle of an animation and its time to refresh a new frame 
         # keep doing it till the cycle is done.
-        if self.motion == Ghost.MOTION_ANIMATE and time.time()-self.lastAnimTime>animFreq:
+        if self.motion == Ghost.MOTION_ANIMATE and now-self.lastAnimTime>animFreq:
             self.idx_frame += 1
             # if we are at the last frame of the cycle, we need to reset the frame
             # and make the ghost idle and ready for next move
@@ -1303,7 +1760,7 @@ class Ghost(object):
                     self.xypos[0] -= self.speed
                 elif self.direction == RIGHT:
                     self.xypos[0] += self.speed
-                self.lastAnimTime = time.time()
+                self.lastAnimTime = now
 
         # If it is not animating, we need to figure out where to go for the next animation cycle
         # NOTE: this must be a separate if, not an elif
@@ -1311,6 +1768,10 @@ class Ghost(object):
 
             # simply follow the pathway if it is not empty
             if self.pathway is not None and len(self.pathway) > 0:
+                # the pathway can be a whole corridor, the mode alternation
+                # should still be able to reverse the ghost in the middle of it
+                if self.mode == Ghost.MODE_SCATTER or self.mode == Ghost.MODE_CHASE:
+                    self.alter_mode(now)
                 self.follow_pathway()
                 return
 
@@ -1321,9 +1782,9 @@ class Ghost(object):
                     self.mode = Ghost.MODE_DEAD
                     self.pathway = ''
                     self.freq_modifier = {} # clear all freq modifier
-                    self.lastDeadTime = time.time()
+                    self.lastDeadTime = now
                 else:
-                    self.pathway = simplepath(level, self, self.uvpos_dyingto)
+                    self.pathway = routepath(level, self, self.uvpos_dyingto)
                     # now we can follow the path
 
             # if the ghost is freightened, we make random path
@@ -1334,9 +1795,9 @@ class Ghost(object):
             else:  # normal state behaviour
 
                 # Try alter the mode only in idle motion and scatter or chase mode
-                self.alter_mode() # this may give a new path 
+                self.alter_mode(now) # this may give a new path 
                 # Try move out of the door only in idle motion and scatter or chase mode
-                self.move_outdoor(level) # this may give a new path too
+                self.move_outdoor(level, now) # this may give a new path too
 
                 if self.pathway is not None and len(self.pathway) > 0:
                     self.follow_pathway()
@@ -1380,7 +1841,7 @@ class Ghost(object):
                         euvpos = xy_to_uv(eatman.xypos)
 
                 # Generate the pathway
-                self.pathway = simplepath(level, self, euvpos)
+                self.pathway = routepath(level, self, euvpos)
 
             # now follow the pathway
             self.follow_pathway()
@@ -1428,12 +1889,12 @@ class Eatman(object):
 
         self.load_sprites()
         self.idx_frame      = 0
-        self.lastAnimTime = time.time()
+        self.lastAnimTime = gameclock.now
 
-        self.lastSlayerTime = time.time()
+        self.lastSlayerTime = gameclock.now
 
         self.energy = 0
-        self.lastEatTime = time.time()
+        self.lastEatTime = gameclock.now
 
 
     def load_sprites(self):
@@ -1466,25 +1927,25 @@ class Eatman(object):
 
     # all modifier will be used in multiplications
     def add_freq_modifier(self, value, duration):
-        stime = time.time()
+        stime = gameclock.now
         name = str(random.random()) + str(stime)
         self.freq_modifier[name] = (value, stime, duration)
         return name
 
 
-    def make_move(self, buff):
+    def make_move(self, buff, now):
 
         # modify the animation frequency by any buff/debuff
         animFreq = self.animFreq
         for key in self.freq_modifier.keys():
             value, stime, duration = self.freq_modifier[key]
-            if duration < 0 or time.time()-stime < duration:
+            if duration < 0 or now-stime < duration:
                 animFreq *= value
             else:
                 del self.freq_modifier[key]
 
         # Only animate the player if it is in animate state and with proper frequency
-        if self.motion == Eatman.MOTION_ANIMATE and time.time()-self.lastAnimTime>animFreq:
+        if self.motion == Eatman.MOTION_ANIMATE and now-self.lastAnimTime>animFreq:
             self.idx_frame += 1
             if self.idx_frame >= self.nframes:
                 self.idx_frame = 0
@@ -1503,7 +1964,7 @@ class Eatman(object):
                     self.xypos[0] -= self.speed
                 elif self.direction == RIGHT:
                     self.xypos[0] += self.speed
-                self.lastAnimTime = time.time()
+                self.lastAnimTime = now
 
 
     def draw(self, DISPLAYSURF):
@@ -1513,79 +1974,55 @@ class Eatman(object):
         else:
             DISPLAYSURF.blit(self.frames[self.direction][self.idx_frame], self.xypos)
 
-    def animate_dead(self, DISPLAYSURF):
+    def update_dead(self, now):
 
         # Animate it
-        if time.time()-self.lastAnimTime>self.animFreq*3.0:
+        if now-self.lastAnimTime>self.animFreq*3.0:
             self.idx_frame += 1
-            self.lastAnimTime = time.time()
+            self.lastAnimTime = now
             if self.idx_frame >= len(self.frames_dead):
                 self.idx_frame = 0
                 return GAME_STATE_DEAD
 
-        # drawing
-        DISPLAYSURF.blit(self.frames_dead[self.idx_frame], self.xypos)
-
         return GAME_STATE_DYING
 
+    def draw_dead(self, DISPLAYSURF):
+        DISPLAYSURF.blit(self.frames_dead[self.idx_frame], self.xypos)
 
 
-class Bean(object):
-    def __init__(self, uvpos, image):
-        self.uvpos = uvpos
-        self.image = image
-
 
 def randpath(level, ghost):
-    moveto = [UP, LEFT, DOWN, RIGHT]
-    if ghost.movedFrom == UP or (not is_valid_position(level, ghost, voffset=-1)):
-        moveto.remove(UP)
-    if ghost.movedFrom == DOWN or (not is_valid_position(level, ghost, voffset=1)):
-        moveto.remove(DOWN)
-    if ghost.movedFrom == LEFT or (not is_valid_position(level, ghost, uoffset=-1)):
-        moveto.remove(LEFT)
-    if ghost.movedFrom == RIGHT or (not is_valid_position(level, ghost, uoffset=1)):
-        moveto.remove(RIGHT)
+    uvpos = xy_to_uv(ghost.xypos)
+    return pathfinder.random_move(level.get_exits(ghost, uvpos), ghost.movedFrom)
 
-    if len(moveto) == 0:
-        return ghost.movedFrom
 
-    return random.choice(moveto)
+def simplepath(level, ghost, euvpos):
+    uvpos = xy_to_uv(ghost.xypos)
+    return pathfinder.greedy_move(uvpos, euvpos, level.get_exits(ghost, uvpos),
+                                  ghost.movedFrom)
 
 
-def simplepath(level, ghost, euvpos):
-    su, sv = xy_to_uv(ghost.xypos)
-    eu, ev = euvpos
-    
-    moveto = [UP, LEFT, DOWN, RIGHT]
-    if ghost.movedFrom == UP or (not is_valid_position(level, ghost, voffset=-1)):
-        moveto.remove(UP)
-    if ghost.movedFrom == DOWN or (not is_valid_position(level, ghost, voffset=1)):
-        moveto.remove(DOWN)
-    if ghost.movedFrom == LEFT or (not is_valid_position(level, ghost, uoffset=-1)):
-        moveto.remove(LEFT)
-    if ghost.movedFrom == RIGHT or (not is_valid_position(level, ghost, uoffset=1)):
-        moveto.remove(RIGHT)
-
-    if len(moveto) == 0:
-        return ghost.movedFrom
-
-    mindist = 1e20 # Arbitrary high cost
-    for mt in moveto:
-        if mt == UP:
-            dist = (su - eu)**2 + (sv-1 - ev)**2
-        elif mt == LEFT:
-            dist = (su-1 - eu)**2 + (sv - ev)**2
-        elif mt == DOWN:
-            dist = (su - eu)**2 + (sv+1 - ev)**2
-        elif mt == RIGHT:
-            dist = (su+1 - eu)**2 + (sv - ev)**2
-
-        if mindist > dist:
-            mindist = dist
-            choice = mt
-
-    return choice
+def routepath(level, ghost, euvpos):
+    '''
+    Move along a shortest path to the target using the level's flow fields.
+    Targets outside of the walkable cells, e.g. the scatter homes, are routed
+    to their closest walkable cell. If the target cannot be reached, e.g. from
+    inside the ghost chamber, fall back to the greedy simplepath.
+    '''
+    if ghost.mode == Ghost.MODE_DYING:
+        blocks = BLOCKS_GHOST_DYING
+    else:
+        blocks = BLOCKS_GHOST
+    uvpos = xy_to_uv(ghost.xypos)
+    moveto = level.routes.get_move(blocks, uvpos, euvpos, ghost.movedFrom)
+    if moveto is None:
+        return simplepath(level, ghost, euvpos)
+    # There is no other choice in a corridor, so the whole corridor up to the
+    # next junction is given. The dying ghosts go cell by cell since they need
+    # to stop at the reset point.
+    if ghost.mode == Ghost.MODE_DYING:
+        return moveto
+    return level.junctions.get_run(uvpos, moveto)
 
 
 def calc_distsq(spos, epos):
@@ -1629,9 +2066,40 @@ def get_opposite_direction(direction):
 
 
 
+def get_profile(entity):
+    '''
+    The blocker profile of an entity in its current mode
+    '''
+    if isinstance(entity, Ghost) and entity.mode==Ghost.MODE_DYING:
+        return PROFILE_DYING
+    if isinstance(entity, Eatman) and entity.mode==Eatman.MODE_DAO:
+        return PROFILE_DAO
+    return PROFILE_NORMAL
+
+
 def is_valid_position(level, entity, uoffset=0, voffset=0):
 
     u, v = xy_to_uv(entity.xypos)
+    if abs(uoffset) + abs(voffset) == 1 \
+            and u >= 0 and v >= 0 and u < level.ncols and v < level.nrows:
+        if voffset == -1:
+            bit = pathfinder.MOVE_BITS[UP]
+        elif voffset == 1:
+            bit = pathfinder.MOVE_BITS[DOWN]
+        elif uoffset == -1:
+            bit = pathfinder.MOVE_BITS[LEFT]
+        else:
+            bit = pathfinder.MOVE_BITS[RIGHT]
+        return (level.get_exits(entity, (u, v)) & bit) != 0
+
+    return is_valid_cell(level, u, v, uoffset, voffset, get_profile(entity))
+
+
+def is_valid_cell(level, u, v, uoffset, voffset, profile):
+    '''
+    Whether the move from the cell (u, v) by the offsets is allowed for the
+    blocker profile. Used to build the legal move tables of the level.
+    '''
     u += uoffset
     v += voffset
 
@@ -1639,22 +2107,24 @@ def is_valid_position(level, entity, uoffset=0, voffset=0):
         return False
 
     blocks = [L_WALL, L_GHOST_DOOR]
-    if isinstance(entity, Ghost) and entity.mode==Ghost.MODE_DYING:
+    if profile == PROFILE_DYING:
         blocks.remove(L_GHOST_DOOR)
 
     if level.data[v][u] not in blocks:
         return True
     else:
-        if isinstance(entity, Eatman) and entity.mode==Eatman.MODE_DAO:
+        if profile == PROFILE_DAO:
+            # the cell behind the wall must be inside the maze as well
             if level.data[v][u] == L_WALL \
-                    and u>0 and v>0 and u<level.nrows-1 and v<level.ncols-1 \
+                    and u>0 and v>0 and u<level.ncols-1 and v<level.nrows-1 \
+                    and 0 <= u+uoffset < level.ncols and 0 <= v+voffset < level.nrows \
                     and level.data[v+voffset][u+uoffset] not in \
                     blocks+[L_REAL_BLOCK,L_GHOST_0,L_GHOST_1,L_GHOST_2]:
                 return True
         return False
 
 
-def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric):
+def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric, now):
 
     global score, score_reward, nlifes
 
@@ -1694,7 +2164,7 @@ def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, ele
                 neats += 1
                 level.ghost_ate.append(ghost.id)
                 isJustEat = True
-                eatman.lastEatTime = time.time()
+                eatman.lastEatTime = now
                 resource.sounds['eatghost'].play()
             elif ghost.mode == Ghost.MODE_DYING or ghost.mode == Ghost.MODE_DEAD:
                 neats += 1
@@ -1707,11 +2177,12 @@ def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, ele
         elif electric.active and ghost.mode != Ghost.MODE_DYING and electric.uvpos == [gu, gv]:
                 ghost.mode = Ghost.MODE_DYING
                 ghost.freq_modifier = {}
+                ghost.pathway = '' # stop following the corridor
                 score += 100
                 neats += 1
                 level.ghost_ate.append(ghost.id)
                 isJustEat = True
-                eatman.lastEatTime = time.time()
+                eatman.lastEatTime = now
         else:
             if ghost.mode == Ghost.MODE_DYING or ghost.mode == Ghost.MODE_DEAD:
                 neats += 1
@@ -1741,11 +2212,11 @@ def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, ele
     # Check if a bean is hit
     if level.data[v][u] == L_BEAN:
         level.data[v][u] = L_EMPTY
-        del level.dynamicObjects[uv_to_key([u, v])]
+        level.erase_bean([u, v])
         level.nbeans -= 1
         score += 1
         eatman.energy += 1
-        eatman.lastEatTime = time.time()
+        eatman.lastEatTime = now
         resource.sounds['bean-'+str(level.idx_beansound)].play()
         level.idx_beansound += 1
         if level.idx_beansound >=2:
@@ -1760,14 +2231,14 @@ def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, ele
     # Big beans
     if level.data[v][u] == L_BEAN_BIG:
         level.data[v][u] = L_EMPTY
-        del level.dynamicObjects[uv_to_key([u, v])]
+        level.erase_bean([u, v])
         level.nbeans -= 1
         score += 10
         eatman.energy += 1
-        eatman.lastEatTime = time.time()
+        eatman.lastEatTime = now
         resource.sounds['bean-big'].play()
         # eatman is now able to eat ghosts
-        eatman.lastSlayerTime = time.time()
+        eatman.lastSlayerTime = now
         for ghost in ghosts:
             if ghost.mode == Ghost.MODE_SCATTER or ghost.mode == Ghost.MODE_CHASE:
                 ghost.oldMode = ghost.mode
@@ -1797,9 +2268,9 @@ def check_hit(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, ele
         resource.sounds['extralife'].play()
 
     # Do we need decay the energy
-    if time.time() - eatman.lastEatTime > level.energy_decay_time:
+    if now - eatman.lastEatTime > level.energy_decay_time:
         eatman.energy -= 1
-        eatman.lastEatTime = time.time()
+        eatman.lastEatTime = now
         if eatman.energy < level.energyLevel[level.idx_energyLevel-1]:
             eatman.energy = level.energyLevel[level.idx_energyLevel-1]
 
@@ -1817,7 +2288,7 @@ def reset_after_lose(pause_duration, level, eatman, ghosts, fires, fruits, buff)
     eatman.mode = Eatman.MODE_NORMAL
     eatman.idx_frame = 0
     eatman.lastAnimTime = 0
-    eatman.lastEatTime = time.time()
+    eatman.lastEatTime = gameclock.now
     eatman.xypos = uv_to_xy(level.eatman_params['uvpos'])
     for key in eatman.freq_modifier.keys():
         value, stime, duration = eatman.freq_modifier[key]
@@ -1832,13 +2303,13 @@ def reset_after_lose(pause_duration, level, eatman, ghosts, fires, fruits, buff)
         ghost.oldMode = ghost.mode
         ghost.mode_duration = ghost.generate_mode_duration()
         ghost.nalters = 0
-        ghost.lastMaTime = time.time()
+        ghost.lastMaTime = gameclock.now
         ghost.xypos = uv_to_xy(level.ghost_params[ghost.id]['uvpos'])
         ghost.direction = STATIC
         ghost.movedFrom = None
         ghost.idx_frame = 0
-        ghost.lastAnimTime = time.time()
-        ghost.lastIndoorTime = time.time()
+        ghost.lastAnimTime = gameclock.now
+        ghost.lastIndoorTime = gameclock.now
         for key in ghost.freq_modifier.keys():
             value, stime, duration = ghost.freq_modifier[key]
             if duration > 0: # duration is positive means its a temporary buff
@@ -1858,6 +2329,211 @@ def reset_after_lose(pause_duration, level, eatman, ghosts, fires, fruits, buff)
 
     # level finish time
     level.stime += pause_duration
+
+
+def steer_eatman(level, eatman, direction):
+    '''
+    Always change the facing direction when eatman is idle. But only animate
+    it if there is valid space to move. The direction is None when no move
+    is asked for.
+    '''
+    if eatman.motion != Eatman.MOTION_IDLE:
+        return
+
+    if eatman.mode == Eatman.MODE_DAO_PASSING:
+        eatman.motion = Eatman.MOTION_ANIMATE
+
+    elif direction is not None:
+        eatman.direction = direction
+        if direction == UP:
+            isValid = is_valid_position(level, eatman, voffset=-1)
+        elif direction == DOWN:
+            isValid = is_valid_position(level, eatman, voffset=1)
+        elif direction == LEFT:
+            isValid = is_valid_position(level, eatman, uoffset=-1)
+        else:
+            isValid = is_valid_position(level, eatman, uoffset=1)
+        if isValid:
+            eatman.motion = Eatman.MOTION_ANIMATE
+
+
+def update_game(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric, 
+        direction, now):
+    '''
+    Advance the game logic to the game time now with the eatman steered to
+    the given direction. Nothing is drawn or read from the keyboard here, so
+    the game and the headless simulation run the very same logic. Returns the
+    new game state.
+    '''
+    global gameState
+
+    # The regular movements
+    if gameState != GAME_STATE_DYING \
+            and gameState != GAME_STATE_DEAD \
+            and gameState != GAME_STATE_WIN:
+
+        steer_eatman(level, eatman, direction)
+
+        # The eatman
+        eatman.make_move(buff, now)
+
+        # Ghosts
+        for ghost in ghosts:
+            ghost.make_move(level, eatman, fires, now)
+
+        # Fruit
+        for id in range(len(fruits)-1,-1,-1):
+            if fruits[id].is_expired(now):
+                del fruits[id]
+            else:
+                fruits[id].make_move(level, now)
+        if len(fruits)==0 and now-level.fruit_lastSpawnTime > level.fruit_interval:
+            fruits.append(Fruit(level))
+            level.fruit_lastSpawnTime = now
+
+        # Check if anything is hit
+        gameState = check_hit(level, eatman, ghosts, 
+                fires, fruits, ftexts, explosion, buff, electric, now)
+
+    # the fires
+    for id in range(len(fires)-1, -1, -1):
+        if fires[id].is_expired(now):
+            del fires[id] 
+
+    # the timers of the buff and electric
+    buff.update(eatman, now)
+    electric.update(now)
+
+    # Dead?
+    if gameState == GAME_STATE_DYING:
+        gameState = eatman.update_dead(now)
+
+    return gameState
+
+
+class Renderer(object):
+    '''
+    Draws the game frames by restoring and updating only the dirty areas of
+    the screen. These are the areas of the moving objects in this and the
+    last frame, plus the stats when they change. The whole screen is redrawn
+    after something else has drawn over it, e.g. the pause screen.
+    '''
+
+    def __init__(self):
+        self.lastRects = []
+        self.lastStats = None
+        self.isFullRedraw = True
+        self.dirtyRects = None # None for the whole screen
+
+    def invalidate(self):
+        self.isFullRedraw = True
+
+    def get_rects(self, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric):
+        '''
+        The screen areas covered by all the objects drawn on top of the maze
+        '''
+        tileSize = (TILE_WIDTH, TILE_HEIGHT)
+        rects = [pygame.Rect(eatman.xypos, tileSize)]
+        for ghost in ghosts:
+            rects.append(pygame.Rect(ghost.xypos, tileSize))
+        for fire in fires:
+            rects.append(pygame.Rect(fire.xypos, tileSize))
+        for fruit in fruits: # the fruits bounce down a few pixels
+            rects.append(pygame.Rect(fruit.xypos, (TILE_WIDTH, TILE_HEIGHT+max(fruit.y_adjust))))
+        for ftext in ftexts:
+            rects.append(ftext.rect.copy())
+        if buff.active:
+            rects.append(pygame.Rect(buff.xypos, tileSize))
+        if explosion.active:
+            rects.append(pygame.Rect(explosion.xypos, tileSize))
+        if electric.active:
+            rects.append(pygame.Rect(electric.xypos, tileSize))
+        return rects
+
+    def get_stats(self, level):
+        '''
+        What the stats show, they are only redrawn when this changes
+        '''
+        if debugit:
+            return (level.iLevel, score, nlifes, level.idx_energyLevel)
+        return (level.iLevel, score, nlifes)
+
+    def draw(self, level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric, now):
+
+        rects = self.get_rects(eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric)
+        stats = self.get_stats(level)
+        isStatsChanged = self.isFullRedraw or stats != self.lastStats
+
+        # restore the maze under the dirty areas
+        if self.isFullRedraw:
+            level.draw(DISPLAYSURF)
+            self.dirtyRects = None
+        else:
+            screenRect = DISPLAYSURF.get_rect()
+            self.dirtyRects = [rect.clip(screenRect) for rect in self.lastRects + rects]
+            if isStatsChanged: # the bands above and below the maze
+                iymargin = config.get('Game','iymargin')
+                self.dirtyRects.append(pygame.Rect(0, 0, WINDOW_WIDTH, iymargin))
+                self.dirtyRects.append(pygame.Rect(0, WINDOW_HEIGHT-2*TILE_HEIGHT, 
+                    WINDOW_WIDTH, 2*TILE_HEIGHT))
+            self.dirtyRects.extend(level.dirtyRects)
+            for rect in self.dirtyRects:
+                level.draw_area(DISPLAYSURF, rect)
+        level.dirtyRects = []
+
+        # all the objects are drawn again, only the dirty areas are shown
+        draw_game(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric, now)
+        if isStatsChanged:
+            draw_game_stats(level, eatman, ghosts)
+
+        self.lastRects = rects
+        self.lastStats = stats
+        self.isFullRedraw = False
+
+    def update_display(self):
+        if self.dirtyRects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(self.dirtyRects)
+
+
+def draw_game(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric, now):
+    '''
+    Draw all the objects on top of the maze
+    '''
+
+    # the fires
+    for fire in fires:
+        fire.animate(DISPLAYSURF, now)
+
+    # fruit
+    for fruit in fruits:
+        fruit.draw(DISPLAYSURF, now)
+
+    # buff
+    buff.draw(DISPLAYSURF, eatman, now)
+
+    # ghosts
+    for ghost in ghosts:
+        ghost.draw(DISPLAYSURF, eatman, now)
+
+    # explosion
+    explosion.animate(DISPLAYSURF, now)
+
+    # electirc
+    electric.animate(DISPLAYSURF, now)
+
+    if gameState == GAME_STATE_DYING:
+        eatman.draw_dead(DISPLAYSURF)
+    elif gameState != GAME_STATE_DEAD:
+        eatman.draw(DISPLAYSURF)
+
+    # the flashing text notices
+    for id in range(len(ftexts)-1,-1,-1):
+        if ftexts[id].is_expired(now):
+            del ftexts[id]
+        else:
+            ftexts[id].animate(DISPLAYSURF, now)
     
 
 def draw_game_stats(level, eatman, ghosts):
@@ -1949,6 +2625,8 @@ def check_for_key_press(checkEsc=False):
     return None
 
 def terminate():
+    if mazes is not None:
+        mazes.stop()
     pygame.quit()
     sys.exit()
 
@@ -2361,11 +3039,8 @@ def show_win_screen(level, ghosts):
     for ghost in ghosts:
         num = level.ghost_ate.count(ghost.id)
         if num > 0:
-            img = ghost.frames[0].copy()
-            for y in range(7, 7+3):
-                for x in range (8, 8+2):
-                    img.set_at((x,y), BLUE)
-                    img.set_at((x+9,y), BLUE)
+            # the ghost with blue eyes
+            img = resource.get_ghost_frame(ghost.color, 0, (8, 7), BLUE)
             DISPLAYSURF.blit(img, (xx, yy))
             theSurf, theRect = make_text_image(str(num), BASICFONT, WHITE)
             theRect.midleft = (xx+80, yy+TILE_HEIGHT/2)
@@ -2401,7 +3076,7 @@ def show_win_screen(level, ghosts):
     theSurf, theRect = make_text_image('Time', BASICFONT, WHITE)
     theRect.midright = (xx+TILE_WIDTH, yy+TILE_HEIGHT/2)
     DISPLAYSURF.blit(theSurf, theRect)
-    nsecs = int(round(time.time()-level.stime))
+    nsecs = int(round(gameclock.now-level.stime))
     nmins = nsecs/60
     nsecs = nsecs % 60
     theSurf, theRect = make_text_image(str(nmins)+"' "+str(nsecs)+'"', BASICFONT, WHITE)
@@ -2465,7 +3140,17 @@ def pause_before_start():
 
 def main():
 
-    global debugit, gameState, score, score_reward, DISPLAYSURF, BASICFONT, MIDFONT, BIGFONT, CLOCK_FPS, nlifes, hilevel
+    global debugit, gameState, score, score_reward, DISPLAYSURF, BASICFONT, MIDFONT, BIGFONT, CLOCK_FPS, nlifes, hilevel, mazes
+
+    # The workers making the mazes of the levels without a file, started
+    # before pygame so they do not inherit it
+    if config.get('Game','bmazepool'):
+        sizes = set([get_maze_size(iLevel) for iLevel in range(1, MAX_LEVEL+1) 
+            if not os.path.exists(get_level_filename(iLevel))])
+        # one worker is plenty for a few mazes of some milliseconds each
+        mazes = mazepool.MazePool(sorted(sizes), os.path.join(SRCDIR, 'cache', 'mazes.pool'), 
+                nworkers=1)
+        mazes.start()
 
     pygame.init()
     CLOCK_FPS = pygame.time.Clock()
@@ -2537,7 +3222,7 @@ def main():
 
 def run_game(iLevel):
 
-    global gameState, DISPLAYSURF, WINDOW_WIDTH, WINDOW_HEIGHT, nlifes
+    global gameState, DISPLAYSURF, WINDOW_WIDTH, WINDOW_HEIGHT, nlifes, prefetch
 
     # Reset game status and reset the screen to black to start
     gameState = GAME_STATE_NORMAL
@@ -2545,22 +3230,33 @@ def run_game(iLevel):
     # Erase the screen 
     DISPLAYSURF.fill(BACKGROUND_COLOR)
 
-    # Load the level file
+    # Load the level file, or take it from the background if it is ready
+    gameclock.resync()
+    prefetched = prefetch.get(iLevel) if prefetch is not None else None
+    if prefetched is not None:
+        data, compiled = prefetched
+        prefetch = None
+    else:
+        data, compiled = None, None
     level = Level()
-    level.load(iLevel)
+    level.load(iLevel, data)
 
     # Resize the window according to the maze size
     WINDOW_WIDTH = level.ncols*TILE_WIDTH
     WINDOW_HEIGHT = (level.nrows+4)*TILE_HEIGHT
     pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
 
-    # recolor the tiles according to the level requirement
-    resource.recolor_tiles(level)
-    # analyze the data to assign tiles
-    level.analyze_data(DISPLAYSURF)
+    # analyze the data to assign tiles in the colors of the level
+    level.analyze_data(DISPLAYSURF, compiled)
+
+    # prepare the next level while this one is played
+    if iLevel < MAX_LEVEL and (prefetch is None or prefetch.iLevel != iLevel+1):
+        prefetch = LevelPrefetch(iLevel+1, DISPLAYSURF)
+        prefetch.start()
 
 
     # The EatMan
+    gameclock.resync()
     eatman = Eatman(level)
 
     # The ghosts
@@ -2590,11 +3286,13 @@ def run_game(iLevel):
     # a brief wait
     level.draw(DISPLAYSURF)
     for ghost in ghosts:
-        ghost.draw(DISPLAYSURF, eatman)
+        ghost.draw(DISPLAYSURF, eatman, gameclock.now)
     eatman.draw(DISPLAYSURF)
     # Draw game state infos
     draw_game_stats(level, eatman, ghosts)
     pause_before_start()
+    gameclock.resync()
+    renderer = Renderer()
 
     moveLeft  = False
     moveRight = False
@@ -2675,6 +3373,7 @@ def run_game(iLevel):
                     pause_duration = show_pause_screen()
                     if pause_duration is None:
                         gameState = GAME_STATE_RETURN_TITLE
+                        level.routes.stop()
                         return
                     # re-calculate important timers
                     # eatman
@@ -2701,115 +3400,44 @@ def run_game(iLevel):
                     level.fruit_lastSpawnTime += pause_duration
                     # level finish time
                     level.stime += pause_duration
-
-
-        # Always change the facing direction when eatman is idle.
-        # But only animate it if there is valid space to move.
-        if (gameState != GAME_STATE_DYING \
-                and gameState != GAME_STATE_DEAD \
-                and gameState != GAME_STATE_WIN) \
-                and eatman.motion == Eatman.MOTION_IDLE:
-
-            if eatman.mode == Eatman.MODE_DAO_PASSING:
-                eatman.motion = Eatman.MOTION_ANIMATE
-
-            elif moveUp or moveDown or moveLeft or moveRight:
-                if moveUp: 
-                    eatman.direction = UP 
-                    if is_valid_position(level, eatman, voffset=-1):
-                        eatman.motion = Eatman.MOTION_ANIMATE
-                elif moveDown: 
-                    eatman.direction = DOWN
-                    if is_valid_position(level, eatman, voffset=1):
-                        eatman.motion = Eatman.MOTION_ANIMATE
-                elif moveLeft:
-                    eatman.direction = LEFT
-                    if is_valid_position(level, eatman, uoffset=-1):
-                        eatman.motion = Eatman.MOTION_ANIMATE
-                elif moveRight:
-                    eatman.direction = RIGHT
-                    if is_valid_position(level, eatman, uoffset=1):
-                        eatman.motion = Eatman.MOTION_ANIMATE
-
-        # The regular movements
-        if gameState != GAME_STATE_DYING \
-                and gameState != GAME_STATE_DEAD \
-                and gameState != GAME_STATE_WIN:
-
-            # The eatman
-            eatman.make_move(buff)
-
-            # Ghosts
-            for ghost in ghosts:
-                ghost.make_move(level, eatman, fires)
-
-            # Fruit
-            for id in range(len(fruits)-1,-1,-1):
-                if fruits[id].is_expired():
-                    del fruits[id]
-                else:
-                    fruits[id].make_move(level)
-            if len(fruits)==0 and time.time()-level.fruit_lastSpawnTime > level.fruit_interval:
-                fruits.append(Fruit(level))
-                level.fruit_lastSpawnTime = time.time()
-
-            # Check if anything is hit
-            gameState = check_hit(level, eatman, ghosts, 
-                    fires, fruits, ftexts, explosion, buff, electric)
-
+                    gameclock.resync()
+                    renderer.invalidate()
+
+
+        # The key held down, up and down go before left and right
+        direction = None
+        if moveUp:
+            direction = UP
+        elif moveDown:
+            direction = DOWN
+        elif moveLeft:
+            direction = LEFT
+        elif moveRight:
+            direction = RIGHT
+
+        # The game logic, updated once per step of the game clock
+        for now in gameclock.tick():
+            gameState = update_game(level, eatman, ghosts, 
+                    fires, fruits, ftexts, explosion, buff, electric, direction, now)
 
         # Start the drawing
-        level.draw(DISPLAYSURF)
-
-        # the fires
-        for id in range(len(fires)-1, -1, -1):
-            if fires[id].is_expired():
-                del fires[id] 
-            else:
-                fires[id].animate(DISPLAYSURF)
-
-        # fruit
-        for fruit in fruits:
-            fruit.draw(DISPLAYSURF)
-
-        # buff
-        buff.draw(DISPLAYSURF, eatman)
-
-        # ghosts
-        for ghost in ghosts:
-            ghost.draw(DISPLAYSURF, eatman)
-
-        # explosion
-        explosion.animate(DISPLAYSURF)
-
-        # electirc
-        electric.animate(DISPLAYSURF)
-
-        # Draw game state infos
-        draw_game_stats(level, eatman, ghosts)
+        renderer.draw(level, eatman, ghosts, fires, fruits, ftexts, explosion, buff, electric, 
+                gameclock.now)
         
         # Dead?
-        if gameState == GAME_STATE_DYING:
-            gameState = eatman.animate_dead(DISPLAYSURF)
-            if gameState == GAME_STATE_DEAD:
-                nlifes -= 1
-                if nlifes == 0:
-                    time.sleep(0.5)
-                    loopit = False
-                else:
-                    pause_duration = show_lose_screen()
-                    if pause_duration is None:
-                        return
-                    reset_after_lose(pause_duration, level, eatman, ghosts, fires, fruits, buff)
-        else:
-            eatman.draw(DISPLAYSURF)
-
-        # the flashing text notices
-        for id in range(len(ftexts)-1,-1,-1):
-            if ftexts[id].is_expired():
-                del ftexts[id]
+        if gameState == GAME_STATE_DEAD:
+            nlifes -= 1
+            if nlifes == 0:
+                time.sleep(0.5)
+                loopit = False
             else:
-                ftexts[id].animate(DISPLAYSURF)
+                pause_duration = show_lose_screen()
+                if pause_duration is None:
+                    level.routes.stop()
+                    return
+                gameclock.resync()
+                renderer.invalidate()
+                reset_after_lose(pause_duration, level, eatman, ghosts, fires, fruits, buff)
 
         # Win?
         if gameState == GAME_STATE_WIN:
@@ -2820,10 +3448,11 @@ def run_game(iLevel):
             loopit = False
     
         # Update the actual screen image
-        pygame.display.update()
+        renderer.update_display()
         CLOCK_FPS.tick(FPS)
 
     # we are out of the loop 
+    level.routes.stop()
     if gameState == GAME_STATE_WIN:
         show_win_screen(level, ghosts)
     elif gameState == GAME_STATE_DEAD:
@@ -2834,6 +3463,8 @@ def run_game(iLevel):
 if __name__ == '__main__':
 
     import traceback
+    import multiprocessing
+    multiprocessing.freeze_support() # for the maze pool workers of the executable
     try:
         main()
     except Exception as inst:
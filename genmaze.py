@@ -1,6 +1,19 @@
 #!/usr/bin/env python
-
-import sys, random
+'''
+Generate random mazes for the levels without a level file.
+
+Usage: python genmaze.py [-n<count>] [-r<nrows>] [-c<ncols>] [-f<ratio>,...]
+                         [-s<first seed>] [-w<workers>] [-o<directory>]
+
+Generates count mazes for each fill ratio with the seeds from the first seed
+on, in a pool of worker processes. Each maze is written as a level file to
+the directory (the current one by default) and its stats are printed: the
+dead ends, the junctions, the walls broken to join the separated areas the
+generator left and the areas remaining after that.
+'''
+import os, sys, time, random, hashlib
+import multiprocessing
+from array import array
 from string import maketrans
 from pprint import pprint
 
@@ -12,233 +25,156 @@ TILE_FIXED_PATH         = '#'
 TILE_EATMAN             = 'e'
 TILE_TELEPORT           = '$'
 
+# The version of the generator, bump it when a seed would give another maze
+GENERATOR_VERSION       = 1
+
+# Where the mazes generated with a seed are kept
+CACHE_DIR               = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'mazes')
+MAX_CACHE_BYTES         = 8*1024*1024 # the oldest mazes are removed over it
+
+# The symbols that can be walked on, the tunnel blocks are not
+PASSABLE_TILES          = [TILE_BEAN, TILE_VACANCY, TILE_FIXED_PATH, TILE_EATMAN,
+        TILE_TELEPORT, '=', '0', '1', '2', '3']
+
+# The directions of the walks along the walls
+UP                      = 'u'
+DOWN                    = 'd'
+LEFT                    = 'l'
+RIGHT                   = 'r'
+
+'''
+The maze is a flat grid, i.e. an array of the tile symbols row after row, one
+byte each, and the cells are the indices of the grid, i.e. row*ncols+col.
+'''
 
-class Tile(object):
+# The symbols of the generated maze in the level files
+FORMAT_TABLE            = maketrans(TILE_WALL+TILE_BEAN, TILE_FIXED_BARRIER+TILE_VACANCY)
 
-    def __init__(self, (row, col), symbol):
-        self.pos = (row, col)
-        self.symbol = symbol
-        self.links = []
+
+class DisjointSet(object):
+    '''
+    The union-find of the connected parts of the maze, e.g. the walls, by
+    their cells.
+    '''
+
+    def __init__(self, ncells):
+        self.parent = range(ncells)
+        self.size = [1]*ncells
+
+    def find(self, cell):
+        parent = self.parent
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]] # halve the path
+            cell = parent[cell]
+        return cell
+
+    def union(self, cell1, cell2):
+        root1 = self.find(cell1)
+        root2 = self.find(cell2)
+        if root1 == root2:
+            return False
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        return True
+
+    def add_cell(self, grid, nrows, ncols, cell, symbols):
+        '''
+        Join a cell that became one of the symbols to its neighbours of the
+        same symbols.
+        '''
+        row, col = divmod(cell, ncols)
+        for is_inside, next_cell in ((row-1 >= 0, cell-ncols), (row+1 <= nrows-1, cell+ncols),
+                (col-1 >= 0, cell-1), (col+1 <= ncols-1, cell+1)):
+            if is_inside and grid[next_cell] in symbols:
+                self.union(cell, next_cell)
+
+
+def make_disjoint_set(grid, nrows, ncols, symbols):
+    '''
+    The connected parts of the cells of the given symbols
+    '''
+    dset = DisjointSet(nrows*ncols)
+    for cell in range(nrows*ncols):
+        if grid[cell] in symbols:
+            # the right and lower neighbours, the others join from their side
+            if cell % ncols < ncols-1 and grid[cell+1] in symbols:
+                dset.union(cell, cell+1)
+            if cell < (nrows-1)*ncols and grid[cell+ncols] in symbols:
+                dset.union(cell, cell+ncols)
+    return dset
 
 
-def format_maze(tiles, nrows, ncols, printit=False):
+def format_maze(grid, nrows, ncols, printit=False):
 
     # the big beans
     pos_bigbeans = [(3,1), (3,ncols-2), (nrows-4,1), (nrows-4,ncols-2)]
 
     # format the maze
-    data = []
-    for row in range(nrows):
-        oneline = ''
-        for col in range(ncols):
-            pos = (row, col)
-            if (row,col) in pos_bigbeans:
-                oneline += 'O'
-            else:
-                oneline += tiles[pos].symbol
-
-        oneline = oneline.replace(TILE_WALL, TILE_FIXED_BARRIER)
-        oneline = oneline.replace(TILE_BEAN, TILE_VACANCY)
-        data.append(oneline)
-        if printit: 
+    grid = grid[:]
+    for row, col in pos_bigbeans:
+        grid[row*ncols+col] = 'O'
+    text = grid.tostring().translate(FORMAT_TABLE)
+
+    data = [text[row*ncols:(row+1)*ncols] for row in range(nrows)]
+    if printit:
+        for oneline in data:
             print oneline
     return data
 
 
-def pmaze(tiles, nrows, ncols):
+def pmaze(grid, nrows, ncols):
     data = []
     for row in range(nrows):
-        oneline = ''
-        for col in range(ncols):
-            pos = (row, col)
-            oneline += tiles[pos].symbol
-        data.append(oneline)
+        data.append(grid[row*ncols:(row+1)*ncols].tostring())
 
     pprint(data)
 
 
-def get_possible_path(tiles, cell, cells_unvisited, 
-        passable_cells=[TILE_BEAN, TILE_VACANCY, TILE_FIXED_PATH, TILE_EATMAN]):
-    '''
-    Get all possible path around the given cell.
-    '''
-    possible_path = []
-    row, col = cell.pos
-    # up
-    up_cell = tiles[(row-1,col)]
-    if up_cell.symbol in passable_cells and up_cell in cells_unvisited:
-        possible_path.append(up_cell)
-    # down
-    down_cell = tiles[(row+1,col)]
-    if down_cell.symbol in passable_cells and down_cell in cells_unvisited:
-        possible_path.append(down_cell)
-    # left
-    left_cell = tiles[(row,col-1)]
-    if left_cell.symbol in passable_cells and left_cell in cells_unvisited:
-        possible_path.append(left_cell)
-    # right
-    right_cell = tiles[(row,col+1)]
-    if right_cell.symbol in passable_cells and right_cell in cells_unvisited:
-        possible_path.append(right_cell)
-
-    return possible_path
-
-
-def is_forming_blocky(tiles, cell, blocky_type):
-    # make sure we are not making blocky type 
-    row, col = cell.pos 
-    tile_l = tiles[row, col-1]
-    tile_r = tiles[row, col+1]
-    tile_u = tiles[row-1, col]
-    tile_d = tiles[row+1, col]
-    tile_ul = tiles[row-1, col-1]
-    tile_ur = tiles[row-1, col+1]
-    tile_ll = tiles[row+1, col-1]
-    tile_lr = tiles[row+1, col+1]
+def is_forming_blocky(grid, ncols, cell, blocky_type):
+    # make sure we are not making blocky type
+    tile_l = grid[cell-1] in blocky_type
+    tile_r = grid[cell+1] in blocky_type
+    tile_u = grid[cell-ncols] in blocky_type
+    tile_d = grid[cell+ncols] in blocky_type
+    tile_ul = grid[cell-ncols-1] in blocky_type
+    tile_ur = grid[cell-ncols+1] in blocky_type
+    tile_ll = grid[cell+ncols-1] in blocky_type
+    tile_lr = grid[cell+ncols+1] in blocky_type
     # upper left
-    if not(tile_u in blocky_type and tile_l in blocky_type and tile_ul in blocky_type) \
-            and not(tile_u in blocky_type and tile_r in blocky_type and tile_ur in blocky_type) \
-            and not(tile_d in blocky_type and tile_l in blocky_type and tile_ll in blocky_type) \
-            and not(tile_d in blocky_type and tile_r in blocky_type and tile_lr in blocky_type):
+    if not(tile_u and tile_l and tile_ul) \
+            and not(tile_u and tile_r and tile_ur) \
+            and not(tile_d and tile_l and tile_ll) \
+            and not(tile_d and tile_r and tile_lr):
         return False # no blocky is forming
 
     return True
 
 
-def find_possible_breakage(tiles, nrows, ncols, cell, cells_visited):
-    '''
-    Check whether the given cell is a possible position to make a breakage around it.
-    '''
-    row, col = cell.pos
-    passable_cells = [TILE_BEAN, TILE_VACANCY, TILE_FIXED_PATH, TILE_EATMAN]
-
-    # UP 
-    # Make sure the cell to break is a wall and the breakage is going to a visited space
-    if row >= 3 and tiles[(row-2,col)] in cells_visited and tiles[(row-1,col)].symbol==TILE_WALL:
-        if is_forming_blocky(tiles, tiles[(row-1, col)], passable_cells) == False:
-            return (row-1, col)
-
-    # DOWN
-    if row <= nrows-4 and tiles[(row+2,col)] in cells_visited and tiles[(row+1,col)].symbol==TILE_WALL:
-        if is_forming_blocky(tiles, tiles[(row+1, col)], passable_cells) == False:
-            return (row+1, col)
-
-
-    # LEFT
-    if col >= 3 and tiles[(row,col-2)] in cells_visited and tiles[(row,col-1)].symbol==TILE_WALL:
-        if is_forming_blocky(tiles, tiles[(row, col-1)], passable_cells) == False:
-            return (row, col-1)
-
-
-    #RIGHT
-    if col <= ncols-4 and tiles[(row,col+2)] in cells_visited and tiles[(row,col+1)].symbol==TILE_WALL:
-        if is_forming_blocky(tiles, tiles[(row, col+1)], passable_cells) == False:
-            return (row, col+1)
-
-    return None
-
-
-def count_nwalls_surrounded(tiles, pos):
-    row, col = pos
+def count_nwalls_surrounded(grid, ncols, cell):
     nwalls = 0
-    if tiles[(row-1, col)].symbol in [TILE_WALL, TILE_FIXED_BARRIER]:
-        nwalls += 1
-    if tiles[(row+1, col)].symbol in [TILE_WALL, TILE_FIXED_BARRIER]:
-        nwalls += 1
-    if tiles[(row, col-1)].symbol in [TILE_WALL, TILE_FIXED_BARRIER]:
-        nwalls += 1
-    if tiles[(row, col+1)].symbol in [TILE_WALL, TILE_FIXED_BARRIER]:
-        nwalls += 1
+    for next_cell in (cell-ncols, cell+ncols, cell-1, cell+1):
+        if grid[next_cell] == TILE_WALL or grid[next_cell] == TILE_FIXED_BARRIER:
+            nwalls += 1
     return nwalls
 
 
-def get_new_wall_link(tiles, nrows, ncols, wall):
+def walk_wall(grid, nrows, ncols, start):
     '''
-    A link is a group of three walls in a horizontal or vertical fashion.
-    e.g. @@@ is a horizontal link. The character in the middle is called
-    the passage of the link and the both ends are called anchor of the link.
+    Walk the walls connected to the start, depth first and without the outer
+    walls. Returns the paths from the ends of the walk back to the start, as
+    strings of the directions of the steps taken to get to the ends, and
+    whether the walls touch the outer walls.
     '''
-    # this is our starting anchor and we need to find the ending one
-    row, col = wall.pos 
-
-    # possible links from 4 directions
-    POS_UP          = (row-2, col)
-    POS_DOWN        = (row+2, col)
-    POS_LEFT        = (row, col-2)
-    POS_RIGHT       = (row, col+2)
-    candidates = []
-    # Get possible link anchor from all 4 directions. 
-    # The possible links must be between walls.
-    possible_anchor = [TILE_WALL]
-    if tiles[POS_UP].symbol in possible_anchor:
-        candidates.append(POS_UP)
-    if tiles[POS_DOWN].symbol in possible_anchor:
-        candidates.append(POS_DOWN)
-    if tiles[POS_LEFT].symbol in possible_anchor:
-        candidates.append(POS_LEFT)
-    if tiles[POS_RIGHT].symbol in possible_anchor:
-        candidates.append(POS_RIGHT)
-
-    # The links cannot be built through an existing wall or
-    # a fixed path or the eatman
-    invalid_passage = [TILE_WALL, TILE_FIXED_PATH, TILE_EATMAN]
-    if POS_UP in candidates and tiles[(row-1,col)].symbol in invalid_passage:
-        candidates.remove(POS_UP)
-    if POS_DOWN in candidates and tiles[(row+1,col)].symbol in invalid_passage:
-        candidates.remove(POS_DOWN)
-    if POS_LEFT in candidates and tiles[(row,col-1)].symbol in invalid_passage:
-        candidates.remove(POS_LEFT)
-    if POS_RIGHT in candidates and tiles[(row,col+1)].symbol in invalid_passage:
-        candidates.remove(POS_RIGHT)
-
-    # Check if any link would make a vacancy become surrounded by 3 
-    # or more walls. We need to disqualify them. 
-    # The vacancy are those adjacent to the link's passage
-    nwalls_ul = count_nwalls_surrounded(tiles, (row-1, col-1))  # upper left
-    nwalls_ur = count_nwalls_surrounded(tiles, (row-1, col+1))  # upper right
-    nwalls_ll = count_nwalls_surrounded(tiles, (row+1, col-1))  # lower left
-    nwalls_lr = count_nwalls_surrounded(tiles, (row+1, col+1))  # lower right
-
-    if POS_UP in candidates:
-        if nwalls_ul >= 2 or nwalls_ur >= 2:
-            candidates.remove(POS_UP)
-
-    if POS_DOWN in candidates:
-        if nwalls_ll >= 2 or nwalls_lr >= 2:
-            candidates.remove(POS_DOWN)
-
-    if POS_LEFT in candidates:
-        if nwalls_ul >= 2 or nwalls_ll >= 2:
-            candidates.remove(POS_LEFT)
-
-    if POS_RIGHT in candidates:
-        if nwalls_ur >=2 or nwalls_lr >= 2:
-            candidates.remove(POS_RIGHT)
-
-    # make sure the walls do not form a U shape
-    # The theory is to walk from end to end and see if the walk path
-    # is in any of the uld, urd, etc, which are the signs of U shape
-    UP = 'u'
-    DOWN = 'd'
-    LEFT = 'l'
-    RIGHT = 'r'
-    transtable = maketrans('udlr','durl')
-
-    # walk of the given node
-    walk_stack = []
-    walk_visited = []
-    walk_info = {}
+    walk_info = {start: (None, '')} # previous cell, direction
+    walk_stack = [start]
     walk_end = []
-
-    # find the end node
-    walk_stack.append(wall) 
-    walk_info[wall.pos] = (None, '') # previous node, direction
     is_connected_to_boundary = False
-    while len(walk_stack) > 0:
+    while walk_stack:
 
         c_cell = walk_stack.pop()
-        c_row, c_col = c_cell.pos
-        walk_visited.append(c_cell)
+        c_row, c_col = divmod(c_cell, ncols)
         is_middle_node = False
 
         # if it is an outter wall tile, add it directly to the end list
@@ -249,278 +185,295 @@ def get_new_wall_link(tiles, nrows, ncols, wall):
             walk_end.append(c_cell)
             continue
 
-        if c_row-1 > 0:
-            up_cell = tiles[(c_row-1,c_col)]
-            if up_cell.symbol == TILE_WALL \
-                    and up_cell not in walk_visited and up_cell not in walk_stack:
-                walk_stack.append(up_cell)
-                walk_info[up_cell.pos] = (c_cell, UP)
-                is_middle_node = True
-        else:
-            is_connected_to_boundary = True
-
-        if c_row+1 < nrows-1:
-            down_cell = tiles[(c_row+1,c_col)]
-            if down_cell.symbol == TILE_WALL \
-                    and down_cell not in walk_visited and down_cell not in walk_stack:
-                walk_stack.append(down_cell)
-                walk_info[down_cell.pos] = (c_cell, DOWN)
-                is_middle_node = True
-        else:
-            is_connected_to_boundary = True
-
-        if c_col-1 > 0:
-            left_cell = tiles[(c_row,c_col-1)]
-            if left_cell.symbol == TILE_WALL \
-                    and left_cell not in walk_visited and left_cell not in walk_stack:
-                walk_stack.append(left_cell)
-                walk_info[left_cell.pos] = (c_cell, LEFT)
-                is_middle_node = True
-        else:
-            is_connected_to_boundary = True
-
-        if c_col+1 < ncols-1:
-            right_cell = tiles[(c_row,c_col+1)]
-            if right_cell.symbol == TILE_WALL \
-                    and right_cell not in walk_visited and right_cell not in walk_stack:
-                walk_stack.append(right_cell)
-                walk_info[right_cell.pos] = (c_cell, RIGHT)
+        for is_inner, next_cell, direction in ((c_row-1 > 0, c_cell-ncols, UP),
+                (c_row+1 < nrows-1, c_cell+ncols, DOWN), (c_col-1 > 0, c_cell-1, LEFT),
+                (c_col+1 < ncols-1, c_cell+1, RIGHT)):
+            if not is_inner:
+                is_connected_to_boundary = True
+            elif grid[next_cell] == TILE_WALL and next_cell not in walk_info:
+                walk_stack.append(next_cell)
+                walk_info[next_cell] = (c_cell, direction)
                 is_middle_node = True
-        else:
-            is_connected_to_boundary = True
 
         if not is_middle_node:
             walk_end.append(c_cell)
 
-    # reconstruct the path from the end
-    walk_path = {}
+    # reconstruct the path from the ends
+    walk_path = []
     for wend in walk_end:
-        p_cell, direction = walk_info[wend.pos]
-        walk_path[wend.pos] = direction
-        c_cell = p_cell
+        directions = []
+        c_cell = wend
         while c_cell is not None:
-            p_cell, direction = walk_info[c_cell.pos]
-            walk_path[wend.pos] += direction
-            c_cell = p_cell
-        # reverse the path to make it from end to start
-        walk_path[wend.pos] = walk_path[wend.pos].translate(transtable)
+            c_cell, direction = walk_info[c_cell]
+            directions.append(direction)
+        walk_path.append(''.join(directions))
 
-    # walk of the candidate node
-    for ii in range(len(candidates)-1,-1,-1):
-        cand = candidates[ii]
-        walk_stack_cand = []
-        walk_visited_cand = []
-        walk_info_cand = {}
-        walk_end_cand = []
-
-        # find the ending node
-        walk_stack_cand.append(tiles[cand])
-        walk_info_cand[cand] = (None, '')
-        is_connected_to_boundary_cand = False
-        while len(walk_stack_cand) > 0:
-
-            c_cell = walk_stack_cand.pop()
-            c_row, c_col = c_cell.pos
-            walk_visited_cand.append(c_cell)
-            is_middle_node = False
-
-            if c_row <=0 or c_row >= nrows-1 or c_col <= 0 or c_col >= ncols-1:
-                is_connected_to_boundary_cand = True
-                walk_end_cand.append(c_cell)
-                continue
+    return walk_path, is_connected_to_boundary
 
-            if c_row-1 > 0:
-                up_cell = tiles[(c_row-1,c_col)]
-                if up_cell.symbol == TILE_WALL \
-                        and up_cell not in walk_visited_cand and up_cell not in walk_stack_cand:
-                    walk_stack_cand.append(up_cell)
-                    walk_info_cand[up_cell.pos] = (c_cell, UP)
-                    is_middle_node = True
-            else:
-                is_connected_to_boundary_cand = True
-
-            if c_row+1 < nrows-1:
-                down_cell = tiles[(c_row+1,c_col)]
-                if down_cell.symbol == TILE_WALL \
-                        and down_cell not in walk_visited_cand and down_cell not in walk_stack_cand:
-                    walk_stack_cand.append(down_cell)
-                    walk_info_cand[down_cell.pos] = (c_cell, DOWN)
-                    is_middle_node = True
-            else:
-                is_connected_to_boundary_cand = True
-
-            if c_col-1 > 0:
-                left_cell = tiles[(c_row,c_col-1)]
-                if left_cell.symbol == TILE_WALL \
-                        and left_cell not in walk_visited_cand and left_cell not in walk_stack_cand:
-                    walk_stack_cand.append(left_cell)
-                    walk_info_cand[left_cell.pos] = (c_cell, LEFT)
-                    is_middle_node = True
-            else:
-                is_connected_to_boundary_cand = True
-
-            if c_col+1 < ncols-1:
-                right_cell = tiles[(c_row,c_col+1)]
-                if right_cell.symbol == TILE_WALL \
-                        and right_cell not in walk_visited_cand and right_cell not in walk_stack_cand:
-                    walk_stack_cand.append(right_cell)
-                    walk_info_cand[right_cell.pos] = (c_cell, RIGHT)
-                    is_middle_node = True
-            else:
-                is_connected_to_boundary_cand = True
-
-            if not is_middle_node:
-                walk_end_cand.append(c_cell)
-
-        # reconstruct the path to the ending nodes
-        walk_path_cand = {}
-        for wend in walk_end_cand:
-            p_cell, direction = walk_info_cand[wend.pos]
-            walk_path_cand[wend.pos] = direction
-            c_cell = p_cell
-            while c_cell is not None:
-                p_cell, direction = walk_info_cand[c_cell.pos]
-                walk_path_cand[wend.pos] += direction
-                c_cell = p_cell
-            # reverse the order of the path to make it from start to the end
-            walk_path_cand[wend.pos] = walk_path_cand[wend.pos][::-1]
 
-        # check if any of the end nodes make U shape walls
-        disqualified = False
-        for key1 in walk_path.keys():
-            for key2 in walk_path_cand.keys():
-                if cand ==  POS_UP:
-                    combpath = walk_path[key1] + UP + walk_path_cand[key2]
-                elif cand ==  POS_DOWN:
-                    combpath = walk_path[key1] + DOWN + walk_path_cand[key2]
-                elif cand ==  POS_LEFT:
-                    combpath = walk_path[key1] + LEFT + walk_path_cand[key2]
-                elif cand ==  POS_RIGHT:
-                    combpath = walk_path[key1] + RIGHT + walk_path_cand[key2]
-
-                thepath = combpath[0]
-                # eliminate the repeated chars
-                for onechr in combpath[1:]:
-                    if thepath[-1] != onechr:
-                        thepath += onechr
-
-                # Ensure no U shape wall
-                if thepath.find('urd') >= 0 \
-                        or thepath.find('uld') >= 0 \
-                        or thepath.find('lur') >= 0 \
-                        or thepath.find('ldr') >= 0 \
-                        or thepath.find('dru') >= 0 \
-                        or thepath.find('dlu') >= 0 \
-                        or thepath.find('rdl') >= 0 \
-                        or thepath.find('rul') >= 0:
-
-                    disqualified = True
-                    del candidates[ii]
-                    break
+def squeeze_path(path):
+    '''
+    The path without the repeated directions, e.g. uurrd -> urd
+    '''
+    thepath = path[0]
+    for onechr in path[1:]:
+        if thepath[-1] != onechr:
+            thepath += onechr
+    return thepath
 
-                # This ensures no L shape wall thats connected to an outter wall, which
-                # essentially is another U shape wall
-                elif (is_connected_to_boundary or is_connected_to_boundary_cand) \
-                        and (thepath.find('ur') >= 0 \
-                        or thepath.find('ul') >= 0 \
-                        or thepath.find('lu') >= 0 \
-                        or thepath.find('ld') >= 0 \
-                        or thepath.find('dr') >= 0 \
-                        or thepath.find('dl') >= 0 \
-                        or thepath.find('rd') >= 0 \
-                        or thepath.find('ru') >= 0):
-
-                    disqualified = True
-                    del candidates[ii]
-                    break
 
-                # Ensure no Z shape wall
-                # NOTE: We are not limiting this
-                elif thepath.find('uru') >= 0 \
-                        or thepath.find('ulu') >= 0 \
-                        or thepath.find('lul') >= 0 \
-                        or thepath.find('ldl') >= 0 \
-                        or thepath.find('drd') >= 0 \
-                        or thepath.find('dld') >= 0 \
-                        or thepath.find('rdr') >= 0 \
-                        or thepath.find('rur') >= 0:
-
-                    disqualified = True
-                    del candidates[ii]
-                    break
+def is_bad_link(path, is_connected_to_boundary):
+    '''
+    Whether the end to end path of the walls joined by a new link makes them
+    a U, Z or boundary L shape, or too long.
+    '''
+    thepath = squeeze_path(path)
 
-                # We can furthur limit the length of the end-to-end path!
-                # The number of nodes are length of combpath plus 2.
-                elif len(combpath)+2 > 7:
+    # Ensure no U shape wall
+    for shape in ('urd', 'uld', 'lur', 'ldr', 'dru', 'dlu', 'rdl', 'rul'):
+        if shape in thepath:
+            return True
 
-                    disqualified = True
-                    del candidates[ii]
-                    break
+    # This ensures no L shape wall thats connected to an outter wall, which
+    # essentially is another U shape wall
+    if is_connected_to_boundary:
+        for shape in ('ur', 'ul', 'lu', 'ld', 'dr', 'dl', 'rd', 'ru'):
+            if shape in thepath:
+                return True
 
-                #print wall.pos, cand
-                #print thepath, walk_path[key1], walk_path_cand[key2]
-                #print combpath
-                #pmaze(tiles, 21, 21)
+    # Ensure no Z shape wall
+    # NOTE: We are not limiting this
+    for shape in ('uru', 'ulu', 'lul', 'ldl', 'drd', 'dld', 'rdr', 'rur'):
+        if shape in thepath:
+            return True
 
-            if disqualified:
-                break
+    # We can furthur limit the length of the end-to-end path!
+    # The number of nodes are length of combpath plus 2.
+    if len(path)+2 > 7:
+        return True
 
+    return False
 
-    # Make sure no closed area is forming
-    # We cannot merge this simply with the U shape part since they use different wall types
-    # walk of the given node
-    walk_stack = []
-    walk_visited = []
-
-    # we walk the node and see if the candidate nodes can be reach without the new link
-    walk_stack.append(wall) 
-    wall_tiles = [TILE_WALL, TILE_FIXED_BARRIER]
-    while len(walk_stack) > 0:
-        c_cell = walk_stack.pop()
-        c_row, c_col = c_cell.pos
-        walk_visited.append(c_cell)
-
-        if c_row-1 >= 0:
-            up_cell = tiles[(c_row-1,c_col)]
-            if up_cell.symbol in wall_tiles \
-                    and up_cell not in walk_visited and up_cell not in walk_stack:
-                walk_stack.append(up_cell)
-
-        if c_row+1 <= nrows-1:
-            down_cell = tiles[(c_row+1,c_col)]
-            if down_cell.symbol in wall_tiles \
-                    and down_cell not in walk_visited and down_cell not in walk_stack:
-                walk_stack.append(down_cell)
-
-        if c_col-1 >= 0:
-            left_cell = tiles[(c_row,c_col-1)]
-            if left_cell.symbol in wall_tiles \
-                    and left_cell not in walk_visited and left_cell not in walk_stack:
-                walk_stack.append(left_cell)
-
-        if c_col+1 <= ncols-1:
-            right_cell = tiles[(c_row,c_col+1)]
-            if right_cell.symbol in wall_tiles \
-                    and right_cell not in walk_visited and right_cell not in walk_stack:
-                walk_stack.append(right_cell)
-
-    # see if we have reached any candidates and delete them
+
+def get_new_wall_link(grid, nrows, ncols, wall, wall_sets, rng=random):
+    '''
+    A link is a group of three walls in a horizontal or vertical fashion.
+    e.g. @@@ is a horizontal link. The character in the middle is called
+    the passage of the link and the both ends are called anchor of the link.
+    The wall_sets are the connected walls, including the fixed barriers.
+    The link is chosen with the random generator rng.
+    '''
+    # this is our starting anchor and we need to find the ending one
+
+    # possible links from 4 directions, the anchor and the passage
+    links = ((wall-2*ncols, wall-ncols, UP), (wall+2*ncols, wall+ncols, DOWN),
+            (wall-2, wall-1, LEFT), (wall+2, wall+1, RIGHT))
+
+    # Check if any link would make a vacancy become surrounded by 3
+    # or more walls. We need to disqualify them.
+    # The vacancy are those adjacent to the link's passage
+    nwalls_ul = count_nwalls_surrounded(grid, ncols, wall-ncols-1)  # upper left
+    nwalls_ur = count_nwalls_surrounded(grid, ncols, wall-ncols+1)  # upper right
+    nwalls_ll = count_nwalls_surrounded(grid, ncols, wall+ncols-1)  # lower left
+    nwalls_lr = count_nwalls_surrounded(grid, ncols, wall+ncols+1)  # lower right
+    nwalls_sides = {UP: (nwalls_ul, nwalls_ur), DOWN: (nwalls_ll, nwalls_lr),
+            LEFT: (nwalls_ul, nwalls_ll), RIGHT: (nwalls_ur, nwalls_lr)}
+
+    candidates = []
+    for anchor, passage, direction in links:
+        # The possible links must be between walls.
+        if grid[anchor] != TILE_WALL:
+            continue
+        # The links cannot be built through an existing wall or
+        # a fixed path or the eatman
+        if grid[passage] in (TILE_WALL, TILE_FIXED_PATH, TILE_EATMAN):
+            continue
+        if max(nwalls_sides[direction]) >= 2:
+            continue
+        candidates.append((anchor, direction))
+
+    if len(candidates) == 0:
+        return None
+
+    # make sure the walls do not form a U shape
+    # The theory is to walk from end to end and see if the walk path
+    # is in any of the uld, urd, etc, which are the signs of U shape
+    transtable = maketrans('udlr','durl')
+
+    # walk of the given node, the paths turned to go from the ends to it
+    walk_path, is_connected_to_boundary = walk_wall(grid, nrows, ncols, wall)
+    walk_path = [path.translate(transtable) for path in walk_path]
+
+    # walk of the candidate node
     for ii in range(len(candidates)-1,-1,-1):
-        if tiles[candidates[ii]] in walk_visited:
+        cand, direction = candidates[ii]
+
+        # the paths reversed to go from the candidate to the ends
+        walk_path_cand, is_connected_to_boundary_cand = walk_wall(grid, nrows, ncols, cand)
+        walk_path_cand = [path[::-1] for path in walk_path_cand]
+
+        # check if any of the end nodes make U shape walls
+        is_connected = is_connected_to_boundary or is_connected_to_boundary_cand
+        for path in walk_path:
+            for path_cand in walk_path_cand:
+                if is_bad_link(path + direction + path_cand, is_connected):
+                    break
+            else:
+                continue
             del candidates[ii]
+            break
 
+    if len(candidates) == 0:
+        return None
 
+    # Make sure no closed area is forming
+    # We cannot merge this simply with the U shape part since they use different wall types
+    # A link between walls that are already connected would close an area
+    wall_set = wall_sets.find(wall)
+    candidates = [cand for cand, direction in candidates if wall_sets.find(cand) != wall_set]
 
     # now we can choose the link randomly
     if len(candidates) > 0:
-        pos_link = random.choice(candidates)
-        return tiles[pos_link]
+        return rng.choice(candidates)
     else:
         return None
 
 
+def connect_maze(grid, nrows, ncols):
+    '''
+    Make sure every passable cell of the maze can be reached from every other
+    one. The walls between separated areas are broken, the ones that do not
+    make blocky areas first. Returns the cells of the broken walls.
+    '''
+    open_sets = make_disjoint_set(grid, nrows, ncols, PASSABLE_TILES)
+    nareas = len(set([open_sets.find(cell) for cell in range(nrows*ncols)
+        if grid[cell] in PASSABLE_TILES]))
+
+    broken = []
+    for allow_blocky in (False, True):
+        # the link passages of the inner walls, not the cross points
+        for row in range(1, nrows-1):
+            for col in range(1+row%2, ncols-1, 2):
+                if nareas == 1:
+                    return broken
+                cell = row*ncols+col
+                if grid[cell] != TILE_WALL:
+                    continue
+                if col % 2 == 1: # vertical passage
+                    cell1, cell2 = cell-ncols, cell+ncols
+                else:
+                    cell1, cell2 = cell-1, cell+1
+                if grid[cell1] not in PASSABLE_TILES or grid[cell2] not in PASSABLE_TILES \
+                        or open_sets.find(cell1) == open_sets.find(cell2):
+                    continue
+                if not allow_blocky and is_forming_blocky(grid, ncols, cell, PASSABLE_TILES):
+                    continue
+                grid[cell] = TILE_VACANCY
+                open_sets.union(cell, cell1)
+                open_sets.union(cell, cell2)
+                broken.append(cell)
+                nareas -= 1
+
+    return broken
+
+
+def save_maze(data, filename):
+    '''
+    Write the lines of a maze as a level file
+    '''
+    outs = open(filename, 'w')
+    for oneline in data:
+        outs.write(oneline + '\n')
+    outs.close()
 
-def genmaze(nrows, ncols, path_fill_ratio=0.33):
+
+def load_maze(filename):
+    '''
+    Read the lines of a maze from a level file, without the settings and
+    the blank lines (like Level.load of the game)
+    '''
+    infile = open(filename)
+    data = []
+    for oneline in infile.readlines():
+        oneline = oneline.strip()
+        if oneline != '' and oneline.split(' ')[0] not in ('set', 'ghost'):
+            data.append(oneline)
+    infile.close()
+    return data
+
+
+def prune_cache(dirname, ext, max_bytes):
+    '''
+    Remove the least recently used files of the extension from the cache
+    directory until they take no more than max_bytes.
+    '''
+    files = []
+    for name in os.listdir(dirname):
+        if name.endswith(ext):
+            filename = os.path.join(dirname, name)
+            files.append((os.path.getmtime(filename), os.path.getsize(filename), filename))
+    files.sort()
+    total = sum([size for mtime, size, filename in files])
+    for mtime, size, filename in files:
+        if total <= max_bytes:
+            break
+        os.remove(filename)
+        total -= size
+
+
+def get_cache_filename(cachedir, nrows, ncols, path_fill_ratio, seed, connect):
+    '''
+    The file of a seeded maze, named by the hash of everything it depends on
+    '''
+    digest = hashlib.sha1(repr((GENERATOR_VERSION, nrows, ncols, path_fill_ratio, 
+        seed, connect))).hexdigest()
+    return os.path.join(cachedir, digest+'.dat')
+
+
+def genmaze(nrows, ncols, path_fill_ratio=0.33, connect=True, seed=None, cachedir=CACHE_DIR):
+    '''
+    Generate a random maze of the given odd dimensions. With connect, the
+    walls of any separated areas are broken afterwards (see connect_maze).
+
+    Without a seed the global random generator is used. With a seed the maze
+    is always the same one, and it is kept in the cachedir (if not None), so
+    the next time it is only read. The cachedir is kept under
+    MAX_CACHE_BYTES by removing the least recently used mazes.
+    '''
+    if seed is None:
+        return make_maze(nrows, ncols, path_fill_ratio, connect, random)[0]
+
+    filename = None
+    if cachedir is not None:
+        filename = get_cache_filename(cachedir, nrows, ncols, path_fill_ratio, seed, connect)
+        if os.path.exists(filename):
+            try:
+                data = load_maze(filename)
+                os.utime(filename, None) # recently used, so pruned last
+                return data
+            except (IOError, OSError):
+                pass
+
+    data = make_maze(nrows, ncols, path_fill_ratio, connect, random.Random(seed))[0]
+
+    if filename is not None:
+        try:
+            if not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+            # write aside and rename, so a half written file is never read
+            save_maze(data, filename+'.tmp')
+            os.rename(filename+'.tmp', filename)
+            prune_cache(cachedir, '.dat', MAX_CACHE_BYTES)
+        except (IOError, OSError):
+            pass
+    return data
+
+
+def make_maze(nrows, ncols, path_fill_ratio, connect, rng):
+    '''
+    Generate a maze with the random generator rng (see genmaze). Returns the
+    lines of the maze and the cells of the walls broken to connect it.
+    '''
 
     assert nrows >= 15
     assert ncols >= 15
@@ -533,34 +486,29 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
     cc = ncols/2
 
     max_nlinks = ((nrows/2)+1-2)*(nrows/2) + ((ncols/2)+1-2)*(ncols/2)
-    
-    tiles = {}
 
     # First populate the maze as all beans
     # The positions of beans are where the walls can be connected
     # and the beans change to walls
-    for row in range(nrows):
-        for col in range(ncols):
-            pos = (row, col)
-            tiles[pos] = Tile(pos, TILE_BEAN)
+    grid = array('c', TILE_BEAN*(nrows*ncols))
 
     # The surrounding walls
     for col in range(ncols):
-        tiles[(0,col)].symbol = TILE_WALL
-        tiles[(nrows-1,col)].symbol = TILE_WALL
+        grid[col] = TILE_WALL
+        grid[(nrows-1)*ncols+col] = TILE_WALL
     for row in range(nrows):
-        tiles[(row,0)].symbol = TILE_WALL
-        tiles[(row,ncols-1)].symbol = TILE_WALL
+        grid[row*ncols] = TILE_WALL
+        grid[row*ncols+ncols-1] = TILE_WALL
 
     # The vacant cross points
     for row in range(1,nrows-1,2):
         for col in range(1,ncols-1,2):
-            tiles[(row,col)].symbol = TILE_VACANCY
+            grid[row*ncols+col] = TILE_VACANCY
 
     # The wall'd cross points
     for row in range(0,nrows,2):
         for col in range(0,ncols,2):
-            tiles[(row,col)].symbol = TILE_WALL
+            grid[row*ncols+col] = TILE_WALL
 
     # The ghost chamber
     ghost_chamber = [
@@ -583,7 +531,7 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
     for row in rowrange:
         for col in colrange:
             symbol = ghost_chamber[row-rowrange[0]][col-colrange[0]]
-            tiles[(row,col)].symbol = symbol
+            grid[row*ncols+col] = symbol
 
     # The tunnel placeholder
     tunnel_left = [
@@ -606,8 +554,8 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
             ]
     for row in rowrange:
         for col in range(5):
-            tiles[(row,col)].symbol = tunnel_left[row-rowrange[0]][col]
-            tiles[(row,ncols-1-col)].symbol = tunnel_right[row-rowrange[0]][4-col]
+            grid[row*ncols+col] = tunnel_left[row-rowrange[0]][col]
+            grid[row*ncols+ncols-1-col] = tunnel_right[row-rowrange[0]][4-col]
 
     # The eatman's location
     if rc % 2 == 0:
@@ -618,27 +566,15 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
         ce = cc
     else:
         ce = cc - 1
-    tiles[(re,ce)].symbol = TILE_EATMAN
+    grid[re*ncols+ce] = TILE_EATMAN
 
-    # count the symbol categories
-    beans = []
-    vacants = []
+    # only consider the inner walls
     walls = []
-    fpaths = []
-    for row in range(nrows):
-        for col in range(ncols):
-            pos = (row, col)
-            symbol = tiles[pos].symbol
-            if symbol == TILE_BEAN:
-                beans.append(tiles[pos])
-            elif symbol == TILE_VACANCY:
-                vacants.append(tiles[pos])
-            elif symbol == TILE_WALL \
-                    and (row != 0 and row != nrows-1 and col != 0 and col != ncols-1):
-                # only consider the inner walls
-                walls.append(tiles[pos])
-            elif symbol == TILE_FIXED_PATH:
-                fpaths.append(tiles[pos])
+    for row in range(1, nrows-1):
+        for col in range(1, ncols-1):
+            if grid[row*ncols+col] == TILE_WALL:
+                walls.append(row*ncols+col)
+    is_inner_wall = set(walls)
 
     # The walls are all isolated at the beginning
     walls_n_links = {}
@@ -649,8 +585,12 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
     walls_n_links[4] = []
     for wall in walls:
         walls_n_links[0].append(wall)
+    # the number of links of every wall
+    nlinks_wall = array('B', [0]*(nrows*ncols))
+    # the connected walls, updated as the links are built
+    wall_sets = make_disjoint_set(grid, nrows, ncols, [TILE_WALL, TILE_FIXED_BARRIER])
 
-    #format_maze(tiles, nrows, ncols, printit=True)
+    #format_maze(grid, nrows, ncols, printit=True)
 
     # Form walls randomly
     nlinks = 0
@@ -658,37 +598,29 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
     for nn in range(0,4):
         walls_pool = walls_n_links[nn]
         while len(walls_pool) > 0:
-            wall = random.choice(walls_pool)
-            row, col = wall.pos
+            wall = rng.choice(walls_pool)
 
             # get the link candidate
-            newlink_wall = get_new_wall_link(tiles, nrows, ncols, wall)
+            newlink_wall = get_new_wall_link(grid, nrows, ncols, wall, wall_sets, rng)
 
             # if this wall can not be build further, we remove it
             if newlink_wall is None:
                 walls_pool.remove(wall)
                 continue
 
-            row_link, col_link = newlink_wall.pos
-
             # Build the link by change the beans in between into wall
-            if row < row_link:
-                tiles[(row+1,col)].symbol = TILE_WALL
-            elif row > row_link:
-                tiles[(row-1,col)].symbol = TILE_WALL
-            elif col < col_link:
-                tiles[(row,col+1)].symbol = TILE_WALL
-            elif col > col_link:
-                tiles[(row,col-1)].symbol = TILE_WALL
+            passage = (wall+newlink_wall)/2
+            grid[passage] = TILE_WALL
+            wall_sets.add_cell(grid, nrows, ncols, passage, [TILE_WALL, TILE_FIXED_BARRIER])
 
             # update the wall link numbers
-            walls_n_links[len(wall.links)].remove(wall)
-            wall.links.append((row_link, col_link))
-            walls_n_links[len(wall.links)].append(wall)
-            if newlink_wall in walls:
-                walls_n_links[len(newlink_wall.links)].remove(newlink_wall)
-                newlink_wall.links.append((row, col))
-                walls_n_links[len(newlink_wall.links)].append(newlink_wall)
+            walls_n_links[nlinks_wall[wall]].remove(wall)
+            nlinks_wall[wall] += 1
+            walls_n_links[nlinks_wall[wall]].append(wall)
+            if newlink_wall in is_inner_wall:
+                walls_n_links[nlinks_wall[newlink_wall]].remove(newlink_wall)
+                nlinks_wall[newlink_wall] += 1
+                walls_n_links[nlinks_wall[newlink_wall]].append(newlink_wall)
 
             # total number of links
             nlinks += 1
@@ -701,80 +633,8 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
         if done:
             break
 
-    #format_maze(tiles, nrows, ncols, printit=True)
+    #format_maze(grid, nrows, ncols, printit=True)
     
-    ## make sure the entire maze are connected
-    ## TODO:
-    ##  possiblity of more than 2 isolated parts of the maze?
-    #cells_unvisited = []
-    #cells_visited = []
-    #cells_stack = []
-    #for row in range(nrows):
-    #    for col in range(ncols):
-    #        pos = (row, col)
-    #        passable_cells = [TILE_BEAN, TILE_VACANCY, TILE_FIXED_PATH, TILE_EATMAN]
-    #        if tiles[pos].symbol in passable_cells:
-    #            cells_unvisited.append(tiles[pos])
-
-    ## start walking the cells
-    #random.shuffle(cells_unvisited)
-    #cells_stack.append(cells_unvisited[0])
-
-    ## when we still have cells that are unvisited
-    #while len(cells_unvisited) > 0:
-
-    #    # when we have non-zero stacks (means we have path to walk)
-    #    while len(cells_stack) > 0:
-    #        c_cell = cells_stack.pop()
-    #        possible_path = get_possible_path(tiles, c_cell, cells_unvisited)
-    #        for pp in possible_path:
-    #            if pp not in cells_stack:
-    #                cells_stack.append(pp)
-    #        cells_unvisited.remove(c_cell)
-    #        cells_visited.append(c_cell)
-
-    #    # if the maze are not connected, we find the possible place to break the wall
-    #    cells_possible_breakage = []
-    #    if len(cells_unvisited) > 0:
-    #        # the breakable ones
-    #        for cell in cells_unvisited:
-    #            breakpos =  find_possible_breakage(tiles, nrows, ncols, cell, cells_visited)
-    #            if breakpos is not None:
-    #                cells_possible_breakage.append((cell, breakpos))
-    #        # The most separated ones 
-    #        maxdist = 0
-    #        for cell_1, breakpos_1 in cells_possible_breakage:
-    #            for cell_2, breakpos_2 in cells_possible_breakage:
-    #                if cell_1 is cell_2:
-    #                    continue
-    #                dist = (cell_1.pos[0]-cell_2.pos[0])**2 + (cell_1.pos[1]-cell_2.pos[1])**2
-    #                if maxdist < dist:
-    #                    maxdist = dist
-    #                    pair = [(cell_1, breakpos_1), (cell_2, breakpos_2)]
-    #        
-    #        cell_1, breakpos_1 = pair[0]
-    #        cell_2, breakpos_2 = pair[1]
-    #        # break them
-    #        tiles[breakpos_1].symbol = TILE_VACANCY
-    #        tiles[breakpos_2].symbol = TILE_VACANCY
-    #        print 'break', breakpos_1, breakpos_2
-    #        # add the new vacancy to the unvisited list
-    #        cells_unvisited.append(tiles[breakpos_1])
-    #        cells_unvisited.append(tiles[breakpos_2])
-    #        # add the cell_1 and cell_2 to the stack for new walk
-    #        # TODO: Ideally, we wanna to make two breakages for each of the closed area. 
-    #        # Thats why we choose to have cell_1 and cell_2. And starting walking from
-    #        # cell_1 should reach cell_2.
-    #        # However, if the unvisited part of the maze is still not connected by itself,
-    #        # the two breakges will be two of the closed areas. And cell_1 won't reach
-    #        # cell_2. So it has to be dealt differently. For now, we just add both cell_1
-    #        # and cell_2 to the stack and save us the trouble for the case when 2 or more
-    #        # closed areas are in the unvisited part, i.e. only one breakage will happen
-    #        # for each of the closed area.
-    #        cells_stack.append(cell_1)
-    #        cells_stack.append(cell_2)
-
-
     # make the tunnel open
     tunnel_left = [
             '*****',
@@ -796,19 +656,111 @@ def genmaze(nrows, ncols, path_fill_ratio=0.33):
             ]
     for row in rowrange:
         for col in range(5):
-            tiles[(row,col)].symbol = tunnel_left[row-rowrange[0]][col]
-            tiles[(row,ncols-1-col)].symbol = tunnel_right[row-rowrange[0]][4-col]
+            grid[row*ncols+col] = tunnel_left[row-rowrange[0]][col]
+            grid[row*ncols+ncols-1-col] = tunnel_right[row-rowrange[0]][4-col]
+
 
+    # break the walls of the closed areas, if any
+    broken = []
+    if connect:
+        broken = connect_maze(grid, nrows, ncols)
 
     # print the maze
-    #format_maze(tiles, nrows, ncols, printit=True)
+    #format_maze(grid, nrows, ncols, printit=True)
+
+    return format_maze(grid, nrows, ncols), broken
+
+
+def maze_stats(data):
+    '''
+    The dead ends and junctions of the walkable cells of a maze, not counting
+    the ghost chamber and the teleports, and the number of separated areas.
+    '''
+    nrows, ncols = len(data), len(data[0])
+    grid = array('c', ''.join(data))
+    passable = PASSABLE_TILES + ['O']
+
+    ndeadends = 0
+    njunctions = 0
+    for cell in range(nrows*ncols):
+        if grid[cell] not in (TILE_BEAN, TILE_VACANCY, TILE_FIXED_PATH, TILE_EATMAN, 'O'):
+            continue
+        row, col = divmod(cell, ncols)
+        nexits = 0
+        for is_inside, next_cell in ((row-1 >= 0, cell-ncols), (row+1 <= nrows-1, cell+ncols),
+                (col-1 >= 0, cell-1), (col+1 <= ncols-1, cell+1)):
+            if is_inside and grid[next_cell] in passable:
+                nexits += 1
+        if nexits == 1:
+            ndeadends += 1
+        elif nexits >= 3:
+            njunctions += 1
+
+    open_sets = make_disjoint_set(grid, nrows, ncols, passable)
+    nareas = len(set([open_sets.find(cell) for cell in range(nrows*ncols)
+        if grid[cell] in passable]))
+
+    return {'deadends': ndeadends, 'junctions': njunctions, 'areas': nareas}
+
+
+def batch_job((nrows, ncols, path_fill_ratio, seed, outdir)):
+    '''
+    Generate, save and measure one maze of a batch (in a worker process).
+    The maze is the one of genmaze with the seed. The walls broken to connect
+    it tell how many separated areas the generator left, i.e. broken+1.
+    '''
+    stime = time.time()
+    data, broken = make_maze(nrows, ncols, path_fill_ratio, True, random.Random(seed))
+    elapsed = time.time() - stime
 
-    return format_maze(tiles, nrows, ncols)
+    filename = os.path.join(outdir, 'maze-%dx%d-%.2f-%d.dat' % (nrows, ncols, path_fill_ratio, seed))
+    save_maze(data, filename)
 
+    stats = maze_stats(data)
+    stats.update({'filename': filename, 'seed': seed, 'ratio': path_fill_ratio, 'time': elapsed,
+        'broken': len(broken)})
+    return stats
 
 
 if __name__ == '__main__':
 
-    genmaze(21, 21)
+    count = 1
+    nrows = 21
+    ncols = 21
+    ratios = [0.14]
+    seed = 0
+    nworkers = None
+    outdir = '.'
+    for argv in sys.argv[1:]:
+        if argv[0:2] == '-n':
+            count = int(argv[2:])
+        elif argv[0:2] == '-r':
+            nrows = int(argv[2:])
+        elif argv[0:2] == '-c':
+            ncols = int(argv[2:])
+        elif argv[0:2] == '-f':
+            ratios = [float(ratio) for ratio in argv[2:].split(',')]
+        elif argv[0:2] == '-s':
+            seed = int(argv[2:])
+        elif argv[0:2] == '-w':
+            nworkers = int(argv[2:])
+        elif argv[0:2] == '-o':
+            outdir = argv[2:] or '.'
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    jobs = [(nrows, ncols, ratio, seed+ii, outdir) for ratio in ratios for ii in range(count)]
+    workers = multiprocessing.Pool(nworkers)
+    stime = time.time()
+    print '%-40s %5s %10s %9s %8s %9s %6s %5s' % ('file', 'ratio', 'seed', 'time(ms)', 
+            'deadends', 'junctions', 'broken', 'areas')
+    for stats in workers.imap(batch_job, jobs):
+        print '%-40s %5.2f %10d %9.1f %8d %9d %6d %5d' % (os.path.basename(stats['filename']), 
+                stats['ratio'], stats['seed'], stats['time']*1000, 
+                stats['deadends'], stats['junctions'], stats['broken'], stats['areas'])
+    workers.close()
+    workers.join()
+    print '%d mazes of %dx%d in %.2f seconds' % (len(jobs), nrows, ncols, time.time()-stime)
 
 
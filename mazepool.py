@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''
+A pool of generated mazes made ahead of time by worker processes, so a level
+without a file does not have to wait for genmaze.
+'''
+import os, random, threading
+import cPickle
+import multiprocessing
+import genmaze
+
+
+def make_maze(nrows, ncols, path_fill_ratio_range):
+    '''
+    Generate one maze in a worker process. The maze is None if it failed,
+    the pool has to know either way.
+    '''
+    try:
+        path_fill_ratio = random.uniform(*path_fill_ratio_range)
+        return nrows, ncols, genmaze.genmaze(nrows, ncols, path_fill_ratio)
+    except Exception:
+        return nrows, ncols, None
+
+
+class MazePool(object):
+    '''
+    Keeps a few ready mazes for each of the given (nrows, ncols) sizes. The
+    pool is refilled in the background whenever a maze is taken. The mazes
+    left when it is stopped are saved to the file and used the next time.
+    '''
+
+    def __init__(self, sizes, filename=None, nready=2, nworkers=None,
+            path_fill_ratio_range=(0.12, 0.16)):
+        self.sizes = list(sizes)
+        self.filename = filename
+        self.nready = nready
+        self.nworkers = nworkers
+        self.path_fill_ratio_range = path_fill_ratio_range
+
+        self.ready = dict([(size, []) for size in self.sizes])
+        self.npending = dict([(size, 0) for size in self.sizes])
+        self.lock = threading.Lock()
+        self.workers = None
+
+    def start(self):
+        '''
+        Load the saved mazes and start the workers to make the missing ones
+        '''
+        if self.filename is not None and os.path.exists(self.filename):
+            try:
+                infile = open(self.filename, 'rb')
+                version, saved = cPickle.load(infile)
+                infile.close()
+                os.remove(self.filename) # every maze is used only once
+            except Exception:
+                version, saved = None, {}
+            # the mazes of another generator are not used
+            if version != genmaze.GENERATOR_VERSION:
+                saved = {}
+            for size in self.sizes:
+                self.ready[size].extend(saved.get(size, []))
+
+        # every worker has its own random sequence
+        self.workers = multiprocessing.Pool(self.nworkers, random.seed)
+        self.refill()
+
+    def stop(self):
+        '''
+        Stop the workers and save the mazes not used
+        '''
+        if self.workers is None:
+            return
+        self.workers.terminate()
+        self.workers = None
+
+        if self.filename is None:
+            return
+        with self.lock:
+            saved = dict([(size, mazes) for size, mazes in self.ready.items() if mazes])
+        try:
+            if not os.path.exists(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            outs = open(self.filename, 'wb')
+            cPickle.dump((genmaze.GENERATOR_VERSION, saved), outs, 2)
+            outs.close()
+        except (IOError, OSError):
+            pass
+
+    def refill(self):
+        '''
+        Ask the workers for the mazes missing from each size
+        '''
+        if self.workers is None:
+            return
+        with self.lock:
+            for size in self.sizes:
+                for ii in range(self.nready - len(self.ready[size]) - self.npending[size]):
+                    self.npending[size] += 1
+                    self.workers.apply_async(make_maze,
+                            (size[0], size[1], self.path_fill_ratio_range),
+                            callback=self.add)
+
+    def add(self, result):
+        '''
+        Take a maze made by a worker (called in the result thread of the pool)
+        '''
+        nrows, ncols, data = result
+        with self.lock:
+            self.npending[(nrows, ncols)] -= 1
+            if data is not None:
+                self.ready[(nrows, ncols)].append(data)
+
+    def get(self, nrows, ncols):
+        '''
+        A ready maze of the size, or None if there is none yet
+        '''
+        size = (nrows, ncols)
+        if size not in self.ready:
+            return None
+        with self.lock:
+            data = self.ready[size].pop(0) if self.ready[size] else None
+        self.refill()
+        return data
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 import random
+import heapq
+import threading
+from array import array
+from collections import deque, OrderedDict
 
 STATIC                  = 's'
 UP                      = 'u'
@@ -7,6 +11,73 @@ DOWN                    = 'd'
 LEFT                    = 'l'
 RIGHT                   = 'r'
 
+# The possible moves as (direction, row offset, column offset). The order is
+# also the order of preference when two moves are equally good.
+MOVES                   = [(UP, -1, 0), (LEFT, 0, -1), (DOWN, 1, 0), (RIGHT, 0, 1)]
+
+OPPOSITE                = {UP: DOWN, DOWN: UP, LEFT: RIGHT, RIGHT: LEFT}
+
+# The legal exits of a cell are stored as a bit mask of the moves
+MOVE_BITS               = {UP: 1, LEFT: 2, DOWN: 4, RIGHT: 8}
+
+# The moves (in the order of preference) allowed by each of the 16 masks
+MASK_MOVES              = [tuple(move for move in MOVES if mask & MOVE_BITS[move[0]])
+                           for mask in range(16)]
+
+
+def build_exits(nrows, ncols, is_open):
+    '''
+    Build the table of the legal exits of every cell, indexed by
+    row*ncols+col. is_open(u, v, uoffset, voffset) tells whether the move
+    from the cell (u, v) by the offsets is allowed.
+    '''
+    exits = array('B', [0]*(nrows*ncols))
+    for v in range(nrows):
+        for u in range(ncols):
+            mask = 0
+            for direction, drow, dcol in MOVES:
+                if is_open(u, v, dcol, drow):
+                    mask |= MOVE_BITS[direction]
+            exits[v*ncols+u] = mask
+    return exits
+
+
+def greedy_move(suvpos, euvpos, exits, movedFrom):
+    '''
+    Choose the exit that is closest to the target in straight line. Going
+    back to where it moved from is only allowed in a dead end.
+    '''
+    su, sv = suvpos
+    eu, ev = euvpos
+    if movedFrom in MOVE_BITS:
+        exits &= ~MOVE_BITS[movedFrom]
+    moves = MASK_MOVES[exits]
+    if len(moves) == 0:
+        return movedFrom
+
+    mindist = Pathfinder.HIGH_COST
+    for direction, drow, dcol in moves:
+        dist = (su+dcol - eu)**2 + (sv+drow - ev)**2
+        if mindist > dist:
+            mindist = dist
+            choice = direction
+
+    return choice
+
+
+def random_move(exits, movedFrom):
+    '''
+    Choose a random exit other than the one it moved from.
+    '''
+    if movedFrom in MOVE_BITS:
+        exits &= ~MOVE_BITS[movedFrom]
+    moves = MASK_MOVES[exits]
+    if len(moves) == 0:
+        return movedFrom
+
+    return random.choice(moves)[0]
+
+
 class Pathfinder(object):
 
     NODE_TYPE_UNINITIALED   = -1
@@ -16,13 +87,30 @@ class Pathfinder(object):
     NODE_TYPE_END           = 3
     NODE_TYPE_CURRENT       = 4
 
+    # The states of the cells in the incremental search (see chasepath)
+    CHASE_NEW               = 0
+    CHASE_OPEN              = 1
+    CHASE_CLOSED            = 2
+
     HIGH_COST               = 1e20
 
     def __init__ (self):
         # use the unfold( (row, col) ) function to convert a 2D coordinate pair
-        # into a 1D index to use with this array.
-        self.map = {}
+        # into a 1D index to use with these arrays.
+        # The nodes are stored as a structure of arrays, one flat array per
+        # node attribute. The parent is stored as the 1D index of the parent
+        # node (-1 for none).
         self.size = (-1, -1) # rows by columns
+        self.g = array('l')
+        self.h = array('l')
+        self.f = array('l')
+        self.parent = array('l')
+        self.type = array('b')
+
+        # The pristine values used to bulk reset the arrays between searches
+        self.blankValues = array('l')
+        self.blankTypes = array('b')
+        self.blankFlags = bytearray()
         
         self.pathChainRev = ''
         self.pathChain = ''
@@ -33,67 +121,39 @@ class Pathfinder(object):
         
         # current node (used by algorithm)
         self.current = (-1, -1)
+
+        # number of junctions expanded by the last graph search
+        self.nexpanded = 0
         
         # open and closed lists of nodes to consider (used by algorithm)
+        # The open list is a binary heap of (f, sequence, (row, col)) entries.
+        # Entries are never removed from the middle of the heap, instead the
+        # membership flags are cleared and stale entries are skipped when they
+        # reach the top (lazy deletion).
         self.openlist = []
-        self.closelist = []
+        self.openflags = bytearray()
+        self.closeflags = bytearray()
+        self.sequence = 0
         
         # used in algorithm (adjacent neighbors path finder is allowed to consider)
         self.neighborSet = [ (0, -1), (0, 1), (-1, 0), (1, 0) ]
 
+        # The state of the incremental search (see chasepath), which survives
+        # between searches and is only discarded by init_map
+        self.chaseReady = False
+        self.cneighbors = None
 
-    def simplepath(self, level, ghost, suvpos, euvpos, pos_check_func):
-
-        su, sv = suvpos
-        eu, ev = euvpos
-        
-        moveto = [UP, LEFT, DOWN, RIGHT]
-
-        if ghost.movedFrom == UP or (not pos_check_func(level, ghost, voffset=-1)):
-            moveto.remove(UP)
-        if ghost.movedFrom == DOWN or (not pos_check_func(level, ghost, voffset=1)):
-            moveto.remove(DOWN)
-        if ghost.movedFrom == LEFT or (not pos_check_func(level, ghost, uoffset=-1)):
-            moveto.remove(LEFT)
-        if ghost.movedFrom == RIGHT or (not pos_check_func(level, ghost, uoffset=1)):
-            moveto.remove(RIGHT)
-
-        if len(moveto) == 0:
-            return ghost.movedFrom
-
-        mindist = Pathfinder.HIGH_COST
-        for mt in moveto:
-            if mt == UP:
-                dist = (su - eu)**2 + (sv-1 - ev)**2
-            elif mt == LEFT:
-                dist = (su-1 - eu)**2 + (sv - ev)**2
-            elif mt == DOWN:
-                dist = (su - eu)**2 + (sv+1 - ev)**2
-            elif mt == RIGHT:
-                dist = (su+1 - eu)**2 + (sv - ev)**2
-
-            if mindist > dist:
-                mindist = dist
-                choice = mt
-
-        return choice
 
+    def simplepath(self, suvpos, euvpos, exits, movedFrom):
+        '''
+        exits is the mask of the legal exits of the start cell (see
+        build_exits).
+        '''
+        return greedy_move(suvpos, euvpos, exits, movedFrom)
 
-    def randpath(self, level, ghost, eatman, pos_check_func):
-        moveto = [UP, LEFT, DOWN, RIGHT]
-        if ghost.movedFrom == UP or (not pos_check_func(level, ghost, voffset=-1)):
-            moveto.remove(UP)
-        if ghost.movedFrom == DOWN or (not pos_check_func(level, ghost, voffset=1)):
-            moveto.remove(DOWN)
-        if ghost.movedFrom == LEFT or (not pos_check_func(level, ghost, uoffset=-1)):
-            moveto.remove(LEFT)
-        if ghost.movedFrom == RIGHT or (not pos_check_func(level, ghost, uoffset=1)):
-            moveto.remove(RIGHT)
 
-        if len(moveto) == 0:
-            return ghost.movedFrom
-
-        return random.choice(moveto)
+    def randpath(self, exits, movedFrom):
+        return random_move(exits, movedFrom)
 
 
     def astarpath(self, suvpos, euvpos):
@@ -105,10 +165,10 @@ class Pathfinder(object):
         self.epos = (euvpos[1], euvpos[0])
 
         # add start node to open list
-        self.add_to_openlist( self.spos )
         self.setG ( self.spos, 0 )
         self.setH ( self.spos, 0 )
         self.setF ( self.spos, 0 )
+        self.add_to_openlist( self.spos )
         
         doContinue = True
         
@@ -135,11 +195,11 @@ class Pathfinder(object):
                             self.remove_from_openlist( thisNeighbor )
                             
                         if not self.is_in_openlist( thisNeighbor ) and not self.is_in_closelist( thisNeighbor ):
-                            self.add_to_openlist( thisNeighbor )
                             self.setG( thisNeighbor, cost )
                             self.calcH( thisNeighbor )
                             self.calcF( thisNeighbor )
                             self.set_parent( thisNeighbor, self.current )
+                            self.add_to_openlist( thisNeighbor )
             else:
                 doContinue = False
                         
@@ -171,109 +231,328 @@ class Pathfinder(object):
         
         return self.pathChain
 
-    def init_map(self, level, blocks):
-        self.map = {}
-        self.size = (level.nrows, level.ncols)
-
-        # initialize path_finder map to a 2D array of empty nodes
-        for row in range(0, self.size[0], 1):
-            for col in range(0, self.size[1], 1):
+    def graphpath(self, graph, suvpos, euvpos):
+        '''
+        Search the shortest path on the junction graph instead of the cells.
+        The start and end cells can be in the middle of the corridors. The
+        returned path is the directions to walk cell by cell, or False if
+        there is no path.
+        '''
+        table = graph.table
+        sid = table.get_id((suvpos[1], suvpos[0]))
+        tid = table.get_id((euvpos[1], euvpos[0]))
+        if sid < 0 or tid < 0:
+            return False
+        if sid == tid:
+            return ''
+
+        # the corridors the end cell is on, keyed by their starting junction
+        endings = {}
+        for node, path, offset in graph.passing[tid]:
+            endings.setdefault(node, []).append(path[:offset])
+
+        best = False
+        openlist = []
+        self.nexpanded = 0
+        if graph.isnode[sid]:
+            openlist.append((0, sid, ''))
+        else:
+            # walk both ways to the junctions at the ends of the start corridor
+            for direction, nid in table.exits[sid]:
+                path, cells = graph.walk(nid, direction, sid)
+                if tid in cells:
+                    path = path[:cells.index(tid)+1]
+                    if best is False or len(path) < len(best):
+                        best = path
+                elif graph.isnode[cells[-1]]:
+                    heapq.heappush(openlist, (len(path), cells[-1], path))
+
+        closed = set()
+        while len(openlist) > 0:
+            cost, node, path = heapq.heappop(openlist)
+            if best is not False and cost >= len(best):
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            self.nexpanded += 1
+            if node == tid:
+                best = path
+                break
+            for part in endings.get(node, []):
+                if best is False or cost + len(part) < len(best):
+                    best = path + part
+            for direction, edgepath, cells in graph.edges[node]:
+                if cells[-1] not in closed:
+                    heapq.heappush(openlist, (cost + len(edgepath), cells[-1], path + edgepath))
+
+        return best
+
+    def chasepath(self, suvpos, euvpos):
+        '''
+        Incremental A* for chasing a moving target, in the fashion of
+        Fringe-Retrieving A* (FRA*). The search tree is rooted at the start
+        cell and kept between calls:
+
+        - When the end moves, the expanded cells keep their exact distances,
+          so the search goes on from the open cells of the previous one. The
+          open list is re-keyed lazily, its old keys are lower bounds of the
+          new ones by the distance the end moved. An end that moves within
+          the expanded cells needs no expansion at all.
+        - When the start moves to a cell of the tree, e.g. one step along the
+          path, its subtree is still a tree of shortest paths and is kept.
+          Only the rest is removed, and the removed cells next to the kept
+          ones are opened again.
+
+        Any other start restarts the search. The returned path is the
+        directions to walk from the start cell, or False if there is no path.
+        '''
+        start = self.unfold((suvpos[1], suvpos[0]))
+        goal = self.unfold((euvpos[1], euvpos[0]))
+        if self.type[start] == Pathfinder.NODE_TYPE_BLOCKED \
+                or self.type[goal] == Pathfinder.NODE_TYPE_BLOCKED:
+            return False
 
-                self.set_node( (row, col), self.create_new_node() )
+        self.nexpanded = 0
+        if not self.chaseReady or self.cstate[start] != Pathfinder.CHASE_CLOSED:
+            self.chase_initialize(start, goal)
+        else:
+            if start != self.chaseStart:
+                self.chase_reroot(start)
+            if goal != self.chaseGoal:
+                # the keys in the open list stay lower bounds by raising the key modifier
+                self.chaseKm += self.chase_heuristic(self.chaseGoal, goal)
+                self.chaseGoal = goal
+
+        if not self.chase_compute_path():
+            return False
 
-                if level.data[row][col] in list(blocks):
-                    self.set_type((row, col), Pathfinder.NODE_TYPE_BLOCKED)
-                else:
-                    self.set_type((row, col), Pathfinder.NODE_TYPE_NOT_VISITED)
+        # follow the parents back from the end
+        directions = []
+        current = goal
+        while current != start:
+            parent = self.cparent[current]
+            directions.append(self.cdirections[current - parent])
+            current = parent
+        directions.reverse()
+        return ''.join(directions)
+
+    def chase_initialize(self, start, goal):
+        if self.cneighbors is None:
+            # the walkable neighbors of every cell
+            self.cneighbors = []
+            for idx in range(self.size[0]*self.size[1]):
+                row, col = divmod(idx, self.size[1])
+                neighbors = []
+                if self.type[idx] != Pathfinder.NODE_TYPE_BLOCKED:
+                    for direction, drow, dcol in MOVES:
+                        if 0 <= row+drow < self.size[0] and 0 <= col+dcol < self.size[1] \
+                                and self.get_type((row+drow, col+dcol)) != Pathfinder.NODE_TYPE_BLOCKED:
+                            neighbors.append(self.unfold((row+drow, col+dcol)))
+                self.cneighbors.append(neighbors)
+            # the direction of a move by the difference of the cell indices
+            self.cdirections = dict([(drow*self.size[1] + dcol, direction)
+                for direction, drow, dcol in MOVES])
+
+        ncells = len(self.cneighbors)
+        self.cg = array('l', [0]) * ncells
+        self.cparent = array('l', [-1]) * ncells
+        self.cstate = bytearray(ncells)
+        self.copen = {}
+        self.cheap = []
+        self.chaseKm = 0
+        self.chaseStart = start
+        self.chaseGoal = goal
+        self.chase_push(start)
+        self.chaseReady = True
+
+    def chase_heuristic(self, idx1, idx2):
+        row1, col1 = divmod(idx1, self.size[1])
+        row2, col2 = divmod(idx2, self.size[1])
+        return abs(row1 - row2) + abs(col1 - col2)
+
+    def chase_key(self, idx):
+        # the ties are broken in favour of the deeper cells
+        g = self.cg[idx]
+        return (g + self.chase_heuristic(idx, self.chaseGoal) + self.chaseKm, -g)
+
+    def chase_push(self, idx):
+        key = self.chase_key(idx)
+        self.copen[idx] = key
+        self.cstate[idx] = Pathfinder.CHASE_OPEN
+        heapq.heappush(self.cheap, (key, idx))
+
+    def chase_pop(self):
+        # discard the entries of removed or re-keyed cells (lazy deletion)
+        while len(self.cheap) > 0:
+            key, idx = heapq.heappop(self.cheap)
+            if self.copen.get(idx) == key:
+                return key, idx
+        return None, -1
+
+    def chase_reroot(self, start):
+        '''
+        Make the start, a cell of the tree, the new root. The g values are
+        only meaningful relative to the root, so the kept ones are not touched.
+        '''
+        # the cells out of the subtree of the new start
+        removed = []
+        stack = [self.chaseStart]
+        while stack:
+            idx = stack.pop()
+            removed.append(idx)
+            for nid in self.cneighbors[idx]:
+                if nid != start and self.cparent[nid] == idx \
+                        and self.cstate[nid] != Pathfinder.CHASE_NEW:
+                    stack.append(nid)
+        for idx in removed:
+            if self.cstate[idx] == Pathfinder.CHASE_OPEN:
+                del self.copen[idx]
+            self.cstate[idx] = Pathfinder.CHASE_NEW
+            self.cparent[idx] = -1
+        self.cparent[start] = -1
+        self.chaseStart = start
+
+        # the removed cells next to the kept closed cells are open again
+        for idx in removed:
+            best = -1
+            for nid in self.cneighbors[idx]:
+                if self.cstate[nid] == Pathfinder.CHASE_CLOSED \
+                        and (best < 0 or self.cg[nid] < self.cg[best]):
+                    best = nid
+            if best >= 0:
+                self.cg[idx] = self.cg[best] + 1
+                self.cparent[idx] = best
+                self.chase_push(idx)
+
+        # drop the stale heap entries once they outnumber the live ones
+        if len(self.cheap) > 2*len(self.copen) + 64:
+            self.cheap = [(key, idx) for idx, key in self.copen.items()]
+            heapq.heapify(self.cheap)
+
+    def chase_compute_path(self):
+        goal = self.chaseGoal
+        while self.cstate[goal] != Pathfinder.CHASE_CLOSED:
+            key, idx = self.chase_pop()
+            if idx < 0:
+                return False
+            newKey = self.chase_key(idx)
+            if key < newKey:
+                self.chase_push(idx)
+                continue
+            del self.copen[idx]
+            self.cstate[idx] = Pathfinder.CHASE_CLOSED
+            self.nexpanded += 1
+            g = self.cg[idx] + 1
+            for nid in self.cneighbors[idx]:
+                state = self.cstate[nid]
+                if state == Pathfinder.CHASE_CLOSED:
+                    continue
+                if state == Pathfinder.CHASE_NEW or g < self.cg[nid]:
+                    self.cg[nid] = g
+                    self.cparent[nid] = idx
+                    self.chase_push(nid)
+        return True
 
-    def create_new_node(self):
-        node = {}
-        node['g'] = -1
-        node['h'] = -1
-        node['f'] = -1
-        node['parent'] = (-1, -1)
-        node['type'] = Pathfinder.NODE_TYPE_UNINITIALED
-        return node
+    def init_map(self, level, blocks):
+        # the arrays are only re-allocated when the map dimensions change
+        if self.size != (level.nrows, level.ncols):
+            self.size = (level.nrows, level.ncols)
+            ncells = self.size[0] * self.size[1]
+            self.blankValues = array('l', [-1]) * ncells
+            self.blankFlags = bytearray(ncells)
+            self.g = array('l', self.blankValues)
+            self.h = array('l', self.blankValues)
+            self.f = array('l', self.blankValues)
+            self.parent = array('l', self.blankValues)
+            self.openflags = bytearray(ncells)
+            self.closeflags = bytearray(ncells)
+
+        # initialize path_finder map to a 2D array of empty nodes, the node
+        # types are translated from the level characters in a single pass
+        typeTable = [chr(Pathfinder.NODE_TYPE_NOT_VISITED)] * 256
+        for char in blocks:
+            typeTable[ord(char)] = chr(Pathfinder.NODE_TYPE_BLOCKED)
+        chars = ''.join([''.join(line) for line in level.data])
+        self.blankTypes = array('b', chars.translate(''.join(typeTable)))
+        self.type = array('b', self.blankTypes)
+
+        # the map may have changed, so the incremental search starts over
+        self.chaseReady = False
+        self.cneighbors = None
 
     def unfold (self, (row, col)):
         # this function converts a 2D array coordinate pair (row, col)
         # to a 1D-array index, for the object's 1D map array.
         return (row * self.size[1]) + col
     
-    def set_node (self, (row, col), newNode):
-        # sets the value of a particular map cell (usually refers to a node object)
-        self.map[ self.unfold((row, col)) ] = newNode
-        
     def get_type (self, (row, col)):
-        return self.map[ self.unfold((row, col)) ]['type']
+        return self.type[ self.unfold((row, col)) ]
         
     def set_type (self, (row, col), theType):
-        self.map[ self.unfold((row, col)) ]['type'] = theType
+        self.type[ self.unfold((row, col)) ] = theType
 
     def getF (self, (row, col)):
-        return self.map[ self.unfold((row, col)) ]['f']
+        return self.f[ self.unfold((row, col)) ]
 
     def getG (self, (row, col)):
-        return self.map[ self.unfold((row, col)) ]['g']
+        return self.g[ self.unfold((row, col)) ]
     
     def getH (self, (row, col)):
-        return self.map[ self.unfold((row, col)) ]['h']
+        return self.h[ self.unfold((row, col)) ]
         
     def setG (self, (row, col), newValue ):
-        self.map[ self.unfold((row, col)) ]['g'] = newValue
+        self.g[ self.unfold((row, col)) ] = newValue
 
     def setH (self, (row, col), newValue ):
-        self.map[ self.unfold((row, col)) ]['h'] = newValue
+        self.h[ self.unfold((row, col)) ] = newValue
         
     def setF (self, (row, col), newValue ):
-        self.map[ self.unfold((row, col)) ]['f'] = newValue
+        self.f[ self.unfold((row, col)) ] = newValue
         
     def calcH (self, (row, col)):
-        self.setH( (row, col), abs(row - self.epos[0]) + abs(col - self.epos[0]) )
+        self.setH( (row, col), abs(row - self.epos[0]) + abs(col - self.epos[1]) )
         
     def calcF (self, (row, col)):
         self.setF( (row, col), self.getG((row,col)) + self.getH((row,col)) )
     
     def add_to_openlist (self, (row, col) ):
-        self.openlist.append( (row, col) )
+        # the F value must be set before a node is pushed onto the heap
+        self.sequence += 1
+        heapq.heappush( self.openlist, (self.getF( (row, col) ), self.sequence, (row, col)) )
+        self.openflags[ self.unfold((row, col)) ] = 1
         
     def remove_from_openlist (self, (row, col) ):
-        self.openlist.remove( (row, col) )
+        # the heap entry becomes stale and is discarded by get_lowest_F_node
+        self.openflags[ self.unfold((row, col)) ] = 0
         
     def is_in_openlist (self, (row, col) ):
-        if self.openlist.count( (row, col) ) > 0:
-            return True
-        else:
-            return False
+        return self.openflags[ self.unfold((row, col)) ] == 1
         
     def get_lowest_F_node (self):
-        lowestValue = Pathfinder.HIGH_COST # start arbitrarily high
-        lowestPair = (-1, -1)
-        
-        for iOrderedPair in self.openlist:
-            if self.getF( iOrderedPair ) < lowestValue:
-                lowestValue = self.getF( iOrderedPair )
-                lowestPair = iOrderedPair
-        
-        if not lowestPair == (-1, -1):
-            return lowestPair
-        else:
-            return False
+        # pop the stale entries, i.e. nodes removed from the open list or
+        # re-added with a lower F value, until a live one is at the top
+        while len(self.openlist) > 0:
+            f, sequence, pair = self.openlist[0]
+            if self.is_in_openlist( pair ) and f == self.getF( pair ):
+                return pair
+            heapq.heappop( self.openlist )
+        return False
         
     def add_to_closelist (self, (row, col) ):
-        self.closelist.append( (row, col) )
+        self.closeflags[ self.unfold((row, col)) ] = 1
         
     def is_in_closelist (self, (row, col) ):
-        if self.closelist.count( (row, col) ) > 0:
-            return True
-        else:
-            return False
+        return self.closeflags[ self.unfold((row, col)) ] == 1
 
     def set_parent (self, (row, col), (parentRow, parentCol) ):
-        self.map[ self.unfold((row, col)) ]['parent'] = (parentRow, parentCol)
+        self.parent[ self.unfold((row, col)) ] = self.unfold((parentRow, parentCol))
 
     def get_parent (self, (row, col) ):
-        return self.map[ self.unfold((row, col)) ]['parent']
+        idx = self.parent[ self.unfold((row, col)) ]
+        if idx < 0:
+            return (-1, -1)
+        return divmod(idx, self.size[1])
         
     def clear_temp_vars (self):
         # this resets variables needed for a search (but preserves the same map / maze)
@@ -281,5 +560,456 @@ class Pathfinder(object):
         self.pathChain = ''
         self.current = (-1, -1)
         self.openlist = []
-        self.closelist = []
+        self.sequence = 0
+        # bulk reset of the node arrays, no per node work is needed
+        self.g[:] = self.blankValues
+        self.h[:] = self.blankValues
+        self.f[:] = self.blankValues
+        self.parent[:] = self.blankValues
+        self.type[:] = self.blankTypes
+        self.openflags[:] = self.blankFlags
+        self.closeflags[:] = self.blankFlags
+
+
+class LRUCache(object):
+    '''
+    A dictionary of bounded size that evicts the least recently used entry.
+    The hits and misses are counted for sizing the cache.
+    '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.maxsize:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_hit_rate(self):
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits*1.0/(self.hits + self.misses)
+
+
+class RouteTable(object):
+    '''
+    The shortest path distances between the walkable cells of a fixed maze.
+
+    The walkable cells are numbered and the distances from every cell to a
+    target cell form the target's distance field. The all-pairs table, i.e.
+    the fields of all targets stacked in an unsigned short array, is built by
+    a background thread with one BFS per target. Until it is ready, or if the
+    maze is too large for it, the fields are calculated per target on demand
+    and kept in a LRU cache, which may be shared with other route tables.
+
+    The wraps dictionary maps a cell to the cell an entity is moved to when
+    it gets there, e.g. the ends of the teleport tunnels.
+    '''
+
+    UNREACHABLE         = 0xFFFF
+
+    # The memory limit of the all-pairs table (2 bytes per pair of cells)
+    MAX_TABLE_BYTES     = 8*1024*1024
+
+    # The maximum number of per-target fields to keep
+    MAX_FIELDS          = 64
+
+    def __init__(self, level, blocks, wraps=None, cache=None):
+        self.size = (level.nrows, level.ncols)
+        self.blocks = ''.join(sorted(set(blocks)))
+        if wraps is None:
+            wraps = {}
+        if cache is None:
+            cache = LRUCache(RouteTable.MAX_FIELDS)
+
+        # number the walkable cells
+        self.ids = array('l', [-1]) * (self.size[0]*self.size[1])
+        self.cells = []
+        for row in range(self.size[0]):
+            for col in range(self.size[1]):
+                if level.data[row][col] not in blocks:
+                    self.ids[row*self.size[1] + col] = len(self.cells)
+                    self.cells.append((row, col))
+        self.ncells = len(self.cells)
+
+        # the moves out of each cell and the cells leading into each cell
+        self.exits = [[] for cid in range(self.ncells)]
+        self.entries = [[] for cid in range(self.ncells)]
+        for cid in range(self.ncells):
+            row, col = self.cells[cid]
+            for direction, drow, dcol in MOVES:
+                nid = self.get_id((row+drow, col+dcol))
+                if nid < 0:
+                    continue
+                if self.cells[nid] in wraps:
+                    nid = self.get_id(wraps[self.cells[nid]])
+                    if nid < 0:
+                        continue
+                self.exits[cid].append((direction, nid))
+                self.entries[nid].append(cid)
+
+        self.allpairs = None
+        self.cache = cache
+        self.anchors = LRUCache(RouteTable.MAX_FIELDS)
+        self.cancelled = False
+        self.thread = None
+
+    def get_id(self, (row, col)):
+        if row < 0 or col < 0 or row >= self.size[0] or col >= self.size[1]:
+            return -1
+        return self.ids[row*self.size[1] + col]
+
+    def calc_field(self, tid):
+        '''
+        BFS backwards from the target cell for the distances of all cells to it.
+        '''
+        field = array('H', [RouteTable.UNREACHABLE]) * self.ncells
+        field[tid] = 0
+        queue = deque([tid])
+        while len(queue) > 0:
+            cid = queue.popleft()
+            dist = field[cid] + 1
+            for pid in self.entries[cid]:
+                if field[pid] == RouteTable.UNREACHABLE:
+                    field[pid] = dist
+                    queue.append(pid)
+        return field
+
+    def get_field(self, tid):
+        field = self.cache.get((self.blocks, tid))
+        if field is None:
+            field = self.calc_field(tid)
+            self.cache.put((self.blocks, tid), field)
+        return field
+
+    def get_anchor_id(self, (row, col)):
+        '''
+        The walkable cell closest to the given position, which can be a blocked
+        cell or outside of the maze.
+        '''
+        tid = self.get_id((row, col))
+        if tid >= 0:
+            return tid
+        tid = self.anchors.get((row, col))
+        if tid is None:
+            mindistsq = None
+            for cid in range(self.ncells):
+                distsq = (self.cells[cid][0] - row)**2 + (self.cells[cid][1] - col)**2
+                if mindistsq is None or distsq < mindistsq:
+                    mindistsq = distsq
+                    tid = cid
+            self.anchors.put((row, col), tid)
+        return tid
+
+    def start(self):
+        '''
+        Build the all-pairs table in a background thread if it fits the memory limit.
+        '''
+        if self.ncells*self.ncells*2 > RouteTable.MAX_TABLE_BYTES:
+            return
+        self.thread = threading.Thread(target=self.build_allpairs)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.cancelled = True
+
+    def build_allpairs(self):
+        table = array('H')
+        for tid in range(self.ncells):
+            if self.cancelled:
+                return
+            table.extend(self.calc_field(tid))
+        # the table is only visible once it is complete
+        self.allpairs = table
+
+    def get_distance(self, suvpos, euvpos):
+        '''
+        The number of moves from the start to the end cell.
+        '''
+        sid = self.get_id((suvpos[1], suvpos[0]))
+        tid = self.get_id((euvpos[1], euvpos[0]))
+        if sid < 0 or tid < 0:
+            return RouteTable.UNREACHABLE
+        if self.allpairs is not None:
+            return self.allpairs[tid*self.ncells + sid]
+        return self.get_field(tid)[sid]
+
+    def get_move(self, suvpos, euvpos, exclude=None):
+        '''
+        The move from the start cell that is on a shortest path to the end cell.
+        An end cell that is not walkable is replaced by the closest walkable one.
+        The excluded direction is never chosen. Ties are broken by the straight
+        distance to the end cell. None is returned if the start cell is not in
+        the table or the end cell cannot be reached.
+        '''
+        sid = self.get_id((suvpos[1], suvpos[0]))
+        if sid < 0 or self.ncells == 0:
+            return None
+        tid = self.get_anchor_id((euvpos[1], euvpos[0]))
+
+        allpairs = self.allpairs
+        if allpairs is not None:
+            base = tid*self.ncells
+        else:
+            field = self.get_field(tid)
+
+        choice = None
+        for direction, nid in self.exits[sid]:
+            if direction == exclude:
+                continue
+            if allpairs is not None:
+                dist = allpairs[base + nid]
+            else:
+                dist = field[nid]
+            if dist == RouteTable.UNREACHABLE:
+                continue
+            row, col = self.cells[nid]
+            distsq = (col - euvpos[0])**2 + (row - euvpos[1])**2
+            if choice is None or (dist, distsq) < (mindist, mindistsq):
+                mindist, mindistsq = dist, distsq
+                choice = direction
 
+        return choice
+
+
+class FlowFields(object):
+    '''
+    The distance fields (flow fields) of a maze shared by all the entities
+    routing on it. A field is calculated once per target cell and set of
+    blocking characters, and then serves every entity heading to that target
+    until it is evicted from the LRU cache.
+    '''
+
+    def __init__(self, level, wraps=None, maxsize=RouteTable.MAX_FIELDS):
+        self.level = level
+        self.wraps = wraps
+        self.tables = {}
+        self.graphs = {}
+        self.cache = LRUCache(maxsize)
+
+    def get_table(self, blocks):
+        key = ''.join(sorted(set(blocks)))
+        if not self.tables.has_key(key):
+            self.tables[key] = RouteTable(self.level, blocks, self.wraps, self.cache)
+        return self.tables[key]
+
+    def get_graph(self, blocks):
+        table = self.get_table(blocks)
+        if not self.graphs.has_key(table.blocks):
+            self.graphs[table.blocks] = JunctionGraph(table)
+        return self.graphs[table.blocks]
+
+    def get_move(self, blocks, suvpos, euvpos, exclude=None):
+        return self.get_table(blocks).get_move(suvpos, euvpos, exclude)
+
+    def get_distance(self, blocks, suvpos, euvpos):
+        return self.get_table(blocks).get_distance(suvpos, euvpos)
+
+    def stop(self):
+        for key in self.tables:
+            self.tables[key].stop()
+
+
+class JunctionGraph(object):
+    '''
+    The maze of a route table compressed to its junctions. The nodes are the
+    cells without exactly two exits, i.e. the intersections and dead ends.
+    The edges are the corridors between them, weighted by their lengths, and
+    keep the directions to walk along them.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.isnode = bytearray(table.ncells)
+        for cid in range(table.ncells):
+            if len(table.exits[cid]) != 2:
+                self.isnode[cid] = 1
+        self.nodes = [cid for cid in range(table.ncells) if self.isnode[cid]]
+
+        # the corridors out of each node as (direction, path, cells). The
+        # cells are the ones walked through and the last is the end node.
+        self.edges = {}
+        # the corridors passing each cell as (node, path, offset) where the
+        # offset is the number of moves from the node to the cell.
+        self.passing = [[] for cid in range(table.ncells)]
+        for node in self.nodes:
+            self.edges[node] = []
+            for direction, nid in table.exits[node]:
+                path, cells = self.walk(nid, direction, node)
+                self.edges[node].append((direction, path, cells))
+                for offset in range(1, len(cells)):
+                    self.passing[cells[offset-1]].append((node, path, offset))
+
+    def walk(self, cid, direction, origin):
+        '''
+        Follow a corridor from the cell just entered by the given direction
+        until a node is reached, never going back the way it came.
+        '''
+        path = direction
+        cells = [cid]
+        while not self.isnode[cid] and cid != origin:
+            back = OPPOSITE[direction]
+            for direction, nid in self.table.exits[cid]:
+                if direction != back:
+                    break
+            path += direction
+            cid = nid
+            cells.append(cid)
+        return path, cells
+
+    def get_run(self, suvpos, direction):
+        '''
+        The directions from the start cell through the corridor in the given
+        direction up to the next junction.
+        '''
+        sid = self.table.get_id((suvpos[1], suvpos[0]))
+        if sid < 0:
+            return direction
+        if self.isnode[sid]:
+            for edgedir, path, cells in self.edges[sid]:
+                if edgedir == direction:
+                    return path
+        else:
+            for edgedir, nid in self.table.exits[sid]:
+                if edgedir == direction:
+                    return self.walk(nid, direction, sid)[0]
+        return direction
+
+
+class BenchLevel(object):
+    '''
+    A minimal stand-in of the game Level for benchmarking, i.e. a random
+    perfect maze of the given odd dimensions with some walls knocked out
+    to form loops, like the generated game mazes.
+    '''
+
+    def __init__(self, nrows, ncols, loop_ratio=0.1):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.data = [['*']*ncols for row in range(nrows)]
+        stack = [(1, 1)]
+        self.data[1][1] = ' '
+        while len(stack) > 0:
+            row, col = stack[-1]
+            unvisited = []
+            for drow, dcol in [(-2, 0), (2, 0), (0, -2), (0, 2)]:
+                if 0 < row+drow < nrows-1 and 0 < col+dcol < ncols-1 \
+                        and self.data[row+drow][col+dcol] == '*':
+                    unvisited.append((drow, dcol))
+            if len(unvisited) == 0:
+                stack.pop()
+                continue
+            drow, dcol = random.choice(unvisited)
+            self.data[row+drow/2][col+dcol/2] = ' '
+            self.data[row+drow][col+dcol] = ' '
+            stack.append((row+drow, col+dcol))
+        for ii in range(int(nrows*ncols*loop_ratio/4)):
+            row = random.randrange(1, nrows-1)
+            col = random.randrange(1, ncols-1)
+            if (row + col) % 2 == 1:
+                self.data[row][col] = ' '
+
+
+def benchmark(sizes=(21, 41, 61, 81, 101), nsearch=20):
+    '''
+    Time the map setup and the A* search between random open cells on mazes
+    of growing size.
+    '''
+    import timeit
+    random.seed(0)
+    pf = Pathfinder()
+    print '%8s %8s %10s %12s %10s %8s %12s %10s' % ('size', 'cells', 'setup ms', 'ms/search',
+            'closed', 'nodes', 'graph ms', 'expanded')
+    for size in sizes:
+        level = BenchLevel(size, size)
+        stime = timeit.default_timer()
+        pf.init_map(level, '*')
+        pf.clear_temp_vars()
+        setup = timeit.default_timer() - stime
+        opens = [(col, row) for row in range(size) for col in range(size)
+                if level.data[row][col] != '*']
+        pairs = [(random.choice(opens), random.choice(opens)) for ii in range(nsearch)]
+        nclosed = 0
+        stime = timeit.default_timer()
+        for suvpos, euvpos in pairs:
+            pf.astarpath(suvpos, euvpos)
+            nclosed += pf.closeflags.count(chr(1))
+        elapsed = timeit.default_timer() - stime
+        # the same searches on the junction graph
+        graph = JunctionGraph(RouteTable(level, '*'))
+        nexpanded = 0
+        stime = timeit.default_timer()
+        for suvpos, euvpos in pairs:
+            pf.graphpath(graph, suvpos, euvpos)
+            nexpanded += pf.nexpanded
+        elapsed_graph = timeit.default_timer() - stime
+        print '%8s %8d %10.3f %12.3f %10d %8d %12.3f %10d' % ('%dx%d' % (size, size), size*size,
+                setup*1000.0, elapsed*1000.0/nsearch, nclosed/nsearch,
+                len(graph.nodes), elapsed_graph*1000.0/nsearch, nexpanded/nsearch)
+
+
+def benchmark_replan(sizes=(21, 41, 61, 81, 101), nreplan=100):
+    '''
+    Time the replans of a chase, where the target wanders one cell at a time
+    and the start follows the path, with a fresh A* search and with the
+    incremental search, and count the cells each of them expands. The first
+    search of the chase is not counted.
+    '''
+    import timeit
+    random.seed(0)
+    pf = Pathfinder()
+    offsets = dict([(direction, (drow, dcol)) for direction, drow, dcol in MOVES])
+    print '%8s %12s %12s %12s %12s' % ('size', 'astar ms', 'chase ms', 'astar exp', 'chase exp')
+    for size in sizes:
+        level = BenchLevel(size, size)
+        pf.init_map(level, '*')
+        opens = [(row, col) for row in range(size) for col in range(size)
+                if level.data[row][col] != '*']
+        spos = random.choice(opens)
+        epos = random.choice(opens)
+        pf.chasepath((spos[1], spos[0]), (epos[1], epos[0]))
+        elapsed_astar = elapsed_chase = 0.0
+        nexpanded_astar = nexpanded_chase = 0
+        for ii in range(nreplan):
+            stime = timeit.default_timer()
+            pf.astarpath((spos[1], spos[0]), (epos[1], epos[0]))
+            elapsed_astar += timeit.default_timer() - stime
+            nexpanded_astar += pf.closeflags.count(chr(1))
+            stime = timeit.default_timer()
+            path = pf.chasepath((spos[1], spos[0]), (epos[1], epos[0]))
+            elapsed_chase += timeit.default_timer() - stime
+            nexpanded_chase += pf.nexpanded
+            if len(path) > 1:
+                drow, dcol = offsets[path[0]]
+                spos = (spos[0]+drow, spos[1]+dcol)
+            moves = [(epos[0]+drow, epos[1]+dcol) for direction, drow, dcol in MOVES
+                    if level.data[epos[0]+drow][epos[1]+dcol] != '*']
+            epos = random.choice(moves)
+        print '%8s %12.3f %12.3f %12d %12d' % ('%dx%d' % (size, size),
+                elapsed_astar*1000.0/nreplan, elapsed_chase*1000.0/nreplan,
+                nexpanded_astar/nreplan, nexpanded_chase/nreplan)
+
+
+if __name__ == '__main__':
+
+    benchmark()
+    print
+    benchmark_replan()
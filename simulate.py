@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+'''
+Run the game logic of EatMan without a window or sound, e.g. for balancing
+the levels and checking the ghost behaviours. The logic is the same
+update_game of the game, but time moves by a fixed step per frame, so a run
+is reproduced exactly by the same level, seed and inputs.
+
+Usage: python simulate.py [-l<level>] [-n<frames>] [-s<seed>] [-k<keys>]
+
+Without -k the eatman is steered to the closest bean. The keys are a script
+of frame:direction pairs, e.g. -k0:l,120:u,300:r
+'''
+import os, sys, time, random
+from collections import deque
+
+# no window and no sound
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+import eatman as game
+from eatman import UP, DOWN, LEFT, RIGHT
+
+
+def init():
+    '''
+    Load the resources needed by the game logic. Must be called once before
+    any simulation.
+    '''
+    pygame.display.init()
+    pygame.font.init()
+    game.DISPLAYSURF = pygame.display.set_mode((game.WINDOW_WIDTH, game.WINDOW_HEIGHT))
+    game.BASICFONT = pygame.font.Font('freesansbold.ttf', 18)
+    game.MIDFONT = pygame.font.Font('freesansbold.ttf', 46)
+    game.BIGFONT = pygame.font.Font('freesansbold.ttf', 90)
+
+    game.resource.load_tiles()
+    game.resource.load_silent_sounds()
+    game.resource.load_sprites()
+
+
+class ScriptedInput(object):
+    '''
+    Replays a script of (frame, direction) pairs. The direction is held from
+    its frame on, None releases it.
+    '''
+
+    def __init__(self, script):
+        self.script = sorted(script)
+        self.idx = 0
+        self.direction = None
+
+    def __call__(self, sim):
+        while self.idx < len(self.script) and self.script[self.idx][0] <= sim.nframes:
+            self.direction = self.script[self.idx][1]
+            self.idx += 1
+        return self.direction
+
+
+class BeanSeeker(object):
+    '''
+    Steers the eatman along the shortest path to the closest bean.
+    '''
+
+    def __call__(self, sim):
+        level, eatman = sim.level, sim.eatman
+        if eatman.motion != game.Eatman.MOTION_IDLE:
+            return None
+
+        su, sv = game.xy_to_uv(eatman.xypos)
+        exits = level.exits[game.PROFILE_NORMAL]
+        ncols = level.ncols
+        # breadth first search remembering the first move of every cell
+        first = {(su, sv): None}
+        queue = deque([(su, sv)])
+        while queue:
+            u, v = queue.popleft()
+            if level.data[v][u] in (game.L_BEAN, game.L_BEAN_BIG):
+                return first[(u, v)]
+            mask = exits[v*ncols+u]
+            for direction, drow, dcol in game.pathfinder.MASK_MOVES[mask]:
+                nuv = (u+dcol, v+drow)
+                if nuv not in first:
+                    first[nuv] = first[(u, v)] or direction
+                    queue.append(nuv)
+        return None
+
+
+class Simulation(object):
+    '''
+    A game of one level stepped frame by frame without drawing.
+    '''
+
+    def __init__(self, iLevel, controller, seed=None, fps=game.FPS):
+        random.seed(seed)
+        game.gameclock = self.clock = game.SimClock(1.0/fps)
+        game.Ghost.pursuer = None
+
+        game.gameState = game.GAME_STATE_NORMAL
+        game.score = 0
+        game.nlifes = game.config.get('Game','ilifes')
+        game.score_reward = game.config.get('Game','iscorereward')
+
+        self.controller = controller
+        self.nframes = 0
+
+        self.level = game.Level()
+        self.level.load(iLevel)
+        game.WINDOW_WIDTH = self.level.ncols*game.TILE_WIDTH
+        game.WINDOW_HEIGHT = (self.level.nrows+4)*game.TILE_HEIGHT
+        self.level.analyze_data(game.DISPLAYSURF)
+
+        self.eatman = game.Eatman(self.level)
+        self.ghosts = []
+        for i in range(self.level.nghosts):
+            self.ghosts.append(game.Ghost(i, self.level, self.eatman))
+        self.fires = []
+        self.ftexts = []
+        self.fruits = []
+        self.explosion = game.Explosion()
+        self.buff = game.Buff()
+        self.electric = game.Electric()
+
+    def is_finished(self):
+        return game.gameState in (game.GAME_STATE_WIN, game.GAME_STATE_DEAD,
+                game.GAME_STATE_RESTART)
+
+    def step(self):
+        direction = self.controller(self)
+        for now in self.clock.tick():
+            gameState = game.update_game(self.level, self.eatman, self.ghosts,
+                    self.fires, self.fruits, self.ftexts, self.explosion, self.buff,
+                    self.electric, direction, now)
+        if gameState == game.GAME_STATE_DEAD:
+            game.nlifes -= 1
+            if game.nlifes > 0:
+                game.reset_after_lose(0.0, self.level, self.eatman, self.ghosts,
+                        self.fires, self.fruits, self.buff)
+        self.nframes += 1
+
+    def run(self, nframes):
+        while self.nframes < nframes and not self.is_finished():
+            self.step()
+        self.level.routes.stop()
+
+    def get_state(self):
+        '''
+        A snapshot of the game state for comparing runs
+        '''
+        return (game.gameState, game.score, game.nlifes, self.level.nbeans,
+                tuple(self.eatman.xypos), self.eatman.mode,
+                tuple((tuple(ghost.xypos), ghost.mode) for ghost in self.ghosts),
+                tuple(tuple(fruit.xypos) for fruit in self.fruits),
+                len(self.fires))
+
+
+def parse_keys(text):
+    '''
+    Parse a key script of frame:direction pairs, e.g. 0:l,120:u,300:-
+    '''
+    script = []
+    for item in text.split(','):
+        frame, direction = item.split(':')
+        if direction not in (UP, DOWN, LEFT, RIGHT):
+            direction = None
+        script.append((int(frame), direction))
+    return script
+
+
+if __name__ == '__main__':
+
+    iLevel = 1
+    nframes = 20000
+    seed = 0
+    controller = None
+    for argv in sys.argv[1:]:
+        if argv[0:2] == '-l':
+            iLevel = int(argv[2:])
+        elif argv[0:2] == '-n':
+            nframes = int(argv[2:])
+        elif argv[0:2] == '-s':
+            seed = int(argv[2:])
+        elif argv[0:2] == '-k':
+            controller = ScriptedInput(parse_keys(argv[2:]))
+    if controller is None:
+        controller = BeanSeeker()
+
+    init()
+    sim = Simulation(iLevel, controller, seed)
+    stime = time.time()
+    sim.run(nframes)
+    elapsed = time.time() - stime
+
+    states = {game.GAME_STATE_NORMAL: 'playing', game.GAME_STATE_WIN: 'won',
+            game.GAME_STATE_DYING: 'dying', game.GAME_STATE_DEAD: 'dead',
+            game.GAME_STATE_RESTART: 'restart'}
+    print 'level %d, seed %d: %s after %d frames (%.1f game seconds)' % (
+            iLevel, seed, states[game.gameState], sim.nframes, sim.nframes*sim.clock.dt)
+    print 'score %d, lives %d, beans left %d, ghosts eaten %d, fruits eaten %d' % (
+            game.score, game.nlifes, sim.level.nbeans,
+            len(sim.level.ghost_ate), len(sim.level.fruit_ate))
+    print '%.0f frames per second' % (sim.nframes/max(elapsed, 1e-6))